@@ -1,7 +1,10 @@
 import streamlit as st
-from inference import load_models, process_image
+from autotune import load_tuned_config
+from inference import IMAGE_EXTENSIONS, TUNE_CONFIG_NAME, configure_threads, process_image
+from model_registry import get_models
+import cv2
+import io
 import os
-import tempfile
 import zipfile
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,67 +24,66 @@ class_mapping = {
 
 st.title("PPE Detection App")
 
+# Thread counts and PPE batch size from an `inference.py --autotune` run, when there is one
+tuned = load_tuned_config(os.path.join(ppe_models_dir, TUNE_CONFIG_NAME)) or {}
+configure_threads(tuned.get('torch_threads', 0), tuned.get('cv2_threads', 0))
+ppe_batch_size = tuned.get('ppe_batch_size', 32)
+
+# Loaded and warmed up once per process, reloaded only when the weight files change
+with st.spinner("Loading models..."):
+    person_model, ppe_models = get_models(person_model_path, ppe_models_dir)
+
 input_option = st.selectbox("Select Input Type", ["Single Image", "Image Directory"])
 
-def list_files(directory):
-    """ Recursively list all files in the directory. """
-    file_list = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_list.append(os.path.join(root, file))
-    return file_list
+def list_image_members(zip_ref):
+    """ List the image files inside the zip, skipping directories and macOS metadata. """
+    return [
+        member for member in zip_ref.infolist()
+        if not member.is_dir()
+        and not member.filename.startswith("__MACOSX/")
+        and member.filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
 
 if input_option == "Single Image":
     uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
     if uploaded_file is not None:
         with st.spinner("Processing image..."):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_path = os.path.join(temp_dir, uploaded_file.name)
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.read())
-                
-                person_model, ppe_models = load_models(person_model_path, ppe_models_dir)
-                output_dir = tempfile.mkdtemp()
-                process_image(temp_path, person_model, ppe_models, output_dir, class_mapping)
-                
-                output_image_path = os.path.join(output_dir, os.path.basename(temp_path))
-                if os.path.exists(output_image_path):
-                    st.image(output_image_path, caption='Processed Image', use_column_width=True)
-                else:
-                    st.error("Failed to process the image.")
+            # Decoded straight from the upload buffer, nothing touches the disk
+            annotated_image = process_image(uploaded_file.getvalue(), person_model, ppe_models, None, class_mapping,
+                                            ppe_batch_size=ppe_batch_size)
+            if annotated_image is not None:
+                st.image(annotated_image, caption='Processed Image', channels="BGR", use_column_width=True)
+            else:
+                st.error("Failed to process the image.")
 
-        st.success("Processing complete!") 
+        st.success("Processing complete!")
 
 elif input_option == "Image Directory":
     uploaded_dir = st.file_uploader("Upload a directory of images...", type=["zip"], accept_multiple_files=False)
     if uploaded_dir is not None:
-        with st.spinner("Processing images..."):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                upload_temp_path = os.path.join(temp_dir, uploaded_dir.name)
-                with open(upload_temp_path, "wb") as f:
-                    f.write(uploaded_dir.read())
-
-                with zipfile.ZipFile(upload_temp_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
+        with zipfile.ZipFile(uploaded_dir, 'r') as zip_ref:
+            image_members = list_image_members(zip_ref)
 
-                all_files = list_files(temp_dir)
+            if not image_members:
+                st.error("No images found in the uploaded directory.")
+            else:
+                progress = st.progress(0.0, text="Processing images...")
+                result_buffer = io.BytesIO()
 
-                image_files = [f for f in all_files if f.lower().endswith(('png', 'jpg', 'jpeg'))]
+                # Each member is decoded from memory, shown as soon as it is done and added to the result zip
+                with zipfile.ZipFile(result_buffer, 'w') as result_zip:
+                    for index, member in enumerate(image_members):
+                        annotated_image = process_image(zip_ref.read(member), person_model, ppe_models, None, class_mapping,
+                                                        ppe_batch_size=ppe_batch_size)
+                        if annotated_image is None:
+                            st.warning(f"Could not decode {member.filename}. Skipping.")
+                        else:
+                            success, encoded = cv2.imencode(os.path.splitext(member.filename)[1], annotated_image)
+                            if success:
+                                result_zip.writestr(member.filename, encoded.tobytes())
+                            st.image(annotated_image, caption=os.path.basename(member.filename), channels="BGR", use_column_width=True)
+                        progress.progress((index + 1) / len(image_members), text=f"Processed {index + 1}/{len(image_members)} images")
 
-                if not image_files:
-                    st.error("No images found in the uploaded directory.")
-                else:
-                    person_model, ppe_models = load_models(person_model_path, ppe_models_dir)
-                    output_dir = tempfile.mkdtemp()
-                    
-                    for image_file in image_files:
-                        process_image(image_file, person_model, ppe_models, output_dir, class_mapping)
-                    
-                    processed_images = [os.path.join(output_dir, img) for img in os.listdir(output_dir)]
-                    if not processed_images:
-                        st.error("No processed images found.")
-                    else:
-                        for img in processed_images:
-                            st.image(img, caption=os.path.basename(img), use_column_width=True)
+                st.download_button("Download results", result_buffer.getvalue(), file_name="ppe_results.zip", mime="application/zip")
 
         st.success("Processing complete!")
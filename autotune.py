@@ -0,0 +1,196 @@
+# Startup autotuner for inference.py (--autotune)
+# Benchmarks torch threads, OpenCV threads, the PPE crop batch size and the number of worker processes on sample
+# images from --input_dir with the models load_models returns, and keeps the fastest setting whose peak memory
+# stays within --tune_memory_mb. The choice is written to <ppe_models_dir>/autotune.json (or --tune_config),
+# which inference.py and app.py load on later runs; flags given on the command line still take precedence.
+# A config tuned on a machine with a different CPU count or for another backend is ignored.
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from inference import (IMAGE_EXTENSIONS, configure_threads, load_models, make_cascade, make_crop_planner, open_packed_input,
+                       process_image, read_image_bytes)
+
+TUNED_SETTINGS = ('torch_threads', 'cv2_threads', 'ppe_batch_size', 'workers', 'threads_per_worker')
+# Turn a run into a multi-process one, so inference.py only applies them with --use_tuned_workers
+SHARDING_SETTINGS = ('workers', 'threads_per_worker')
+PPE_BATCH_SIZES = (8, 16, 32, 64)
+
+def load_tuned_config(path, backend="torch", keys=TUNED_SETTINGS):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        config = json.load(f)
+    if config.get('cpu_count') != os.cpu_count() or config.get('backend') != backend:
+        print(f"Ignoring {path}: tuned for {config.get('cpu_count')} CPUs and the {config.get('backend')} backend")
+        return None
+    settings = {key: value for key, value in config['settings'].items() if key in keys}
+    print(f"Using tuned settings from {path}: {settings}")
+    return settings
+
+def save_tuned_config(path, best, backend, memory_budget_mb):
+    config = {
+        'settings': {key: best[key] for key in TUNED_SETTINGS},
+        'images_per_sec': round(best['images_per_sec'], 3),
+        'peak_rss_mb': round(best['peak_rss_mb'], 1),
+        'memory_budget_mb': memory_budget_mb,
+        'backend': backend,
+        'cpu_count': os.cpu_count(),
+        'tuned_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    # Written under a temporary name first so a reader never sees half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, path)
+
+def default_memory_budget_mb():
+    # Three quarters of the physical memory
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.75 / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def reset_peak_rss():
+    # Linux only: resets VmHWM to the current RSS so the next reading is the peak of one measurement
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def sample_images(input_dir, limit=8):
+    packed = open_packed_input(input_dir)
+    if packed is not None:
+        return [bytes(packed.image_bytes(i)) for i in range(min(limit, len(packed)))]
+    image_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    # Kept encoded, so every measurement pays for decoding like a real run
+    return [read_image_bytes(os.path.join(input_dir, f)) for f in image_files]
+
+def thread_options():
+    cores = os.cpu_count() or 1
+    options = {cores}
+    threads = 1
+    while threads < cores:
+        options.add(threads)
+        threads *= 2
+    return sorted(options)
+
+def single_process_grid(backend):
+    # torch.set_num_threads does not reach ONNX Runtime sessions, so only the torch backend tunes it
+    torch_options = thread_options() if backend == "torch" else [0]
+    return [
+        {'torch_threads': torch_threads, 'cv2_threads': cv2_threads, 'ppe_batch_size': ppe_batch_size,
+         'workers': 1, 'threads_per_worker': 0}
+        for torch_threads in torch_options
+        for cv2_threads in sorted({1, os.cpu_count() or 1})
+        for ppe_batch_size in PPE_BATCH_SIZES
+    ]
+
+def run_images(images, person_model, ppe_models, class_mapping, args, ppe_batch_size, crop_planner):
+    for data in images:
+        process_image(data, person_model, ppe_models, None, class_mapping, args.fusion, render=args.render,
+                      person_imgsz=args.person_imgsz, crop_planner=crop_planner, ppe_batch_size=ppe_batch_size)
+
+def measure(settings, images, person_model, ppe_models, class_mapping, args, crop_planner):
+    configure_threads(settings['torch_threads'], settings['cv2_threads'])
+    # One untimed image so thread pools and allocator caches are sized for this setting
+    run_images(images[:1], person_model, ppe_models, class_mapping, args, settings['ppe_batch_size'], crop_planner)
+    reset_peak_rss()
+    start = time.perf_counter()
+    run_images(images, person_model, ppe_models, class_mapping, args, settings['ppe_batch_size'], crop_planner)
+    elapsed = time.perf_counter() - start
+    return dict(settings, images_per_sec=len(images) / elapsed if elapsed > 0 else 0.0, peak_rss_mb=peak_rss_mb())
+
+def _measure_worker(args, class_mapping, images, settings, barrier):
+    num_threads = settings['threads_per_worker']
+    configure_threads(num_threads, num_threads)
+    person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend, args.ppe_soup)
+    ppe_models = make_cascade(args, ppe_models)
+    crop_planner = make_crop_planner(args)
+    run_images(images[:1], person_model, ppe_models, class_mapping, args, settings['ppe_batch_size'], crop_planner)
+    # Every worker starts timing together, so the measurement sees them competing for the cores
+    barrier.wait()
+    start = time.perf_counter()
+    run_images(images, person_model, ppe_models, class_mapping, args, settings['ppe_batch_size'], crop_planner)
+    # The peak includes the worker's own copy of the models, which is the real cost of another worker
+    return time.perf_counter() - start, peak_rss_mb()
+
+def measure_workers(settings, images, class_mapping, args):
+    workers = settings['workers']
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # Bounded so a worker that fails to load cannot leave the others waiting forever
+        barrier = manager.Barrier(workers, timeout=600)
+        futures = [executor.submit(_measure_worker, args, class_mapping, images, settings, barrier)
+                   for _ in range(workers)]
+        results = [future.result() for future in futures]
+    elapsed = max(seconds for seconds, _ in results)
+    return dict(settings, images_per_sec=workers * len(images) / elapsed if elapsed > 0 else 0.0,
+                peak_rss_mb=sum(peak for _, peak in results))
+
+def print_result(result, budget_mb):
+    over = " over budget" if budget_mb and result['peak_rss_mb'] > budget_mb else ""
+    print(f"{result['torch_threads'] or '-':>7} {result['cv2_threads'] or '-':>7} {result['ppe_batch_size']:>7} "
+          f"{result['workers']:>7} {result['images_per_sec']:>11.2f} {result['peak_rss_mb']:>9.0f}{over}")
+
+def autotune(args, class_mapping, config_path):
+    images = sample_images(args.input_dir, args.tune_images)
+    if not images:
+        raise ValueError(f"No images in {args.input_dir} to tune on")
+    budget_mb = args.tune_memory_mb or default_memory_budget_mb()
+    print(f"Tuning on {len(images)} images from {args.input_dir}, memory budget "
+          f"{f'{budget_mb} MB' if budget_mb else 'unlimited'}")
+
+    person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend, args.ppe_soup)
+    if not ppe_models:
+        raise ValueError("No PPE models found in the specified directory")
+    ppe_models = make_cascade(args, ppe_models)
+    crop_planner = make_crop_planner(args)
+
+    print(f"{'torch':>7} {'opencv':>7} {'batch':>7} {'workers':>7} {'images/sec':>11} {'peak MB':>9}")
+    results = []
+    for settings in single_process_grid(args.backend):
+        results.append(measure(settings, images, person_model, ppe_models, class_mapping, args, crop_planner))
+        print_result(results[-1], budget_mb)
+    # Every worker loads its own copy of the models, so this one is released first
+    del person_model, ppe_models
+
+    # More processes split the cores between them and reuse the fastest single-process batch size
+    cores = os.cpu_count() or 1
+    single = [result for result in results if not budget_mb or result['peak_rss_mb'] <= budget_mb] or results
+    ppe_batch_size = max(single, key=lambda result: result['images_per_sec'])['ppe_batch_size']
+    workers = 2
+    while workers <= cores:
+        settings = {'torch_threads': 0, 'cv2_threads': 0, 'ppe_batch_size': ppe_batch_size,
+                    'workers': workers, 'threads_per_worker': cores // workers}
+        results.append(measure_workers(settings, images, class_mapping, args))
+        print_result(results[-1], budget_mb)
+        workers *= 2
+
+    fitting = [result for result in results if not budget_mb or result['peak_rss_mb'] <= budget_mb]
+    if fitting:
+        best = max(fitting, key=lambda result: result['images_per_sec'])
+    else:
+        best = min(results, key=lambda result: result['peak_rss_mb'])
+        print(f"No setting fits in {budget_mb} MB, keeping the one with the lowest peak memory")
+    save_tuned_config(config_path, best, args.backend, budget_mb)
+    settings = {key: best[key] for key in TUNED_SETTINGS}
+    print(f"Best: {best['images_per_sec']:.2f} images/sec at {best['peak_rss_mb']:.0f} MB with {settings}, "
+          f"saved to {config_path}")
+    if best['workers'] > 1:
+        print(f"Later runs use {best['workers']} workers only with --use_tuned_workers")
+    return best
@@ -0,0 +1,53 @@
+# Compare two pipeline benchmark results and flag regressions
+# Usage: python -m benchmarks.compare <baseline.json> <current.json> [--threshold 0.1]
+
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+def find_regressions(baseline, current, threshold=0.1, min_delta_ms=0.05):
+    # A stage regresses when a latency percentile grows by more than threshold (and by a measurable amount)
+    regressions = []
+    for stage, base_stats in baseline['stages'].items():
+        if stage not in current['stages']:
+            continue
+        for metric in METRICS:
+            before, after = base_stats[metric], current['stages'][stage][metric]
+            if after > before * (1 + threshold) and after - before > min_delta_ms:
+                regressions.append(f"{stage} {metric}: {before:.2f} -> {after:.2f} ms")
+
+    before, after = baseline['images_per_sec'], current['images_per_sec']
+    if after < before * (1 - threshold):
+        regressions.append(f"images/sec: {before:.2f} -> {after:.2f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag regressions between two benchmark result files.")
+    parser.add_argument('baseline', type=str, help="Result JSON of the reference run.")
+    parser.add_argument('current', type=str, help="Result JSON of the run to check.")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Allowed relative slowdown before flagging.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    print(f"{'stage':<20} " + ' '.join(f"{m + ' Δ%':>10}" for m in METRICS))
+    for stage, base_stats in baseline['stages'].items():
+        if stage in current['stages']:
+            deltas = [(current['stages'][stage][m] / base_stats[m] - 1) * 100 if base_stats[m] else 0.0 for m in METRICS]
+            print(f"{stage:<20} " + ' '.join(f"{d:>+10.1f}" for d in deltas))
+
+    regressions = find_regressions(baseline, current, args.threshold)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+if __name__ == "__main__":
+    main()
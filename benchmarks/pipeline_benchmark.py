@@ -0,0 +1,155 @@
+# Per-stage benchmark of the two-stage pipeline on synthetic images, with stub models or the real weights
+# Usage: python -m benchmarks.pipeline_benchmark [--resolutions 720p 1080p] [--densities 1 5 20] [--output result.json]
+#        python -m benchmarks.pipeline_benchmark --person_model weights/person.pt --ppe_models_dir weights/ppe_models
+
+import argparse
+import json
+import platform
+import time
+import cv2
+import numpy as np
+import inference
+from engines import BACKENDS
+from inference import annotate_image, crop_persons, detect_persons, detect_ppe_ensemble_batch, load_models, offset_ppe_results
+from benchmarks.stubs import load_stub_models
+from benchmarks.synthetic import RESOLUTIONS, generate_dataset
+
+STAGES = ('decode', 'detect_persons', 'crop', 'detect_ppe_ensemble', 'non_max_suppression', 'draw_boxes', 'encode')
+
+class_mapping = {
+    0: 'hard-hat',
+    1: 'gloves',
+    2: 'mask',
+    3: 'glasses',
+    4: 'boots',
+    5: 'vest',
+    6: 'ppe-suit'
+}
+
+class FusionTimer:
+    # Times the fusion step inside detect_ppe_ensemble_batch by wrapping inference.fuse_predictions
+    def __init__(self):
+        self.seconds = 0.0
+        self._original = None
+
+    def _timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._original(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        self._original = inference.fuse_predictions
+        inference.fuse_predictions = self._timed
+        return self
+
+    def __exit__(self, *exc_info):
+        inference.fuse_predictions = self._original
+
+def run_image(item, person_model, ppe_models, fusion, fusion_timer):
+    timings = {}
+
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(item['data'], dtype=np.uint8), cv2.IMREAD_COLOR)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    person_boxes, _ = detect_persons(image, person_model)
+    timings['detect_persons'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    crops, offsets = crop_persons(image, person_boxes)
+    timings['crop'] = time.perf_counter() - start
+
+    fusion_timer.seconds = 0.0
+    start = time.perf_counter()
+    ensemble_results = detect_ppe_ensemble_batch(crops, ppe_models, fusion=fusion)
+    ppe_seconds = time.perf_counter() - start
+    timings['non_max_suppression'] = fusion_timer.seconds
+    timings['detect_ppe_ensemble'] = ppe_seconds - fusion_timer.seconds
+    ppe_results = offset_ppe_results(offsets, ensemble_results)
+
+    start = time.perf_counter()
+    annotated_image = annotate_image(image, ppe_results, class_mapping)
+    timings['draw_boxes'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cv2.imencode('.jpg', annotated_image)
+    timings['encode'] = time.perf_counter() - start
+
+    timings['total'] = sum(timings.values())
+    return timings
+
+def summarize(values):
+    values_ms = np.asarray(values) * 1000
+    return {
+        'mean_ms': float(values_ms.mean()),
+        'p50_ms': float(np.percentile(values_ms, 50)),
+        'p95_ms': float(np.percentile(values_ms, 95)),
+        'p99_ms': float(np.percentile(values_ms, 99)),
+    }
+
+def run_benchmark(dataset, person_model, ppe_models, fusion="nms", repeats=1):
+    per_image = []
+    cases = {}
+    with FusionTimer() as fusion_timer:
+        # Warm-up pass so lazy model initialisation is not billed to the first image
+        run_image(dataset[0], person_model, ppe_models, fusion, fusion_timer)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for item in dataset:
+                timings = run_image(item, person_model, ppe_models, fusion, fusion_timer)
+                per_image.append(timings)
+                cases.setdefault(f"{item['resolution']}_{item['persons']}p", []).append(timings['total'])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'images': len(per_image),
+        'seconds': elapsed,
+        'images_per_sec': len(per_image) / elapsed if elapsed > 0 else 0.0,
+        'stages': {stage: summarize([t[stage] for t in per_image]) for stage in STAGES + ('total',)},
+        'cases': {case: dict(summarize(totals), images_per_sec=len(totals) / sum(totals)) for case, totals in cases.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the person + PPE pipeline.")
+    parser.add_argument('--resolutions', nargs='+', choices=sorted(RESOLUTIONS), default=['720p', '1080p'], help="Synthetic image resolutions.")
+    parser.add_argument('--densities', nargs='+', type=int, default=[1, 5, 20], help="Persons per synthetic image.")
+    parser.add_argument('--images_per_case', type=int, default=5, help="Images generated per resolution and density.")
+    parser.add_argument('--repeats', type=int, default=1, help="Passes over the generated images.")
+    parser.add_argument('--fusion', choices=['nms', 'wbf'], default='nms', help="Fusion of the PPE fold predictions.")
+    parser.add_argument('--folds', type=int, default=5, help="Number of stub PPE folds.")
+    parser.add_argument('--person_latency_ms', type=float, default=0.0, help="Simulated latency per stub person model call.")
+    parser.add_argument('--ppe_latency_ms', type=float, default=0.0, help="Simulated latency per stub PPE fold call.")
+    parser.add_argument('--image_latency_ms', type=float, default=0.0, help="Simulated extra latency per image in a stub call.")
+    parser.add_argument('--person_model', help="Benchmark the real person model instead of the stub.")
+    parser.add_argument('--ppe_models_dir', help="Directory with the real ppe_fold_* models.")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Engine for the real models.")
+    parser.add_argument('--output', help="Write the machine-readable result to this JSON file.")
+    args = parser.parse_args()
+
+    if args.person_model and args.ppe_models_dir:
+        person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend)
+        models = f"real ({args.backend})"
+    else:
+        person_model, ppe_models = load_stub_models(args.folds, args.person_latency_ms / 1000,
+                                                    args.ppe_latency_ms / 1000, args.image_latency_ms / 1000)
+        models = "stub"
+
+    dataset = generate_dataset(args.resolutions, args.densities, args.images_per_case)
+    result = run_benchmark(dataset, person_model, ppe_models, args.fusion, args.repeats)
+    result['config'] = dict(vars(args), models=models, machine=platform.machine(), python=platform.python_version())
+
+    print(f"{'stage':<20} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<20} {stats['mean_ms']:>8.2f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    print(f"{result['images']} images, {result['images_per_sec']:.2f} images/sec")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Stub person and PPE models with the engine interface from engines.py.
+# Outputs are deterministic and latency is configurable, so the pipeline can be benchmarked without weights.
+
+import time
+import cv2
+import numpy as np
+from engines import Detections
+from benchmarks.synthetic import PERSON_COLOR
+
+def _sleep(latency_per_call, latency_per_image, num_images):
+    delay = latency_per_call + latency_per_image * num_images
+    if delay > 0:
+        time.sleep(delay)
+
+class StubPersonModel:
+    # Finds the PERSON_COLOR blobs painted by benchmarks.synthetic
+    def __init__(self, latency_per_call=0.0, latency_per_image=0.0, min_area=16):
+        self.latency_per_call = latency_per_call
+        self.latency_per_image = latency_per_image
+        self.min_area = min_area
+
+    def __call__(self, images, imgsz=640):
+        _sleep(self.latency_per_call, self.latency_per_image, len(images))
+        detections = []
+        for image in images:
+            mask = cv2.inRange(image, np.array(PERSON_COLOR) - 5, np.array(PERSON_COLOR) + 5)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            stats = stats[1:]
+            stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area]
+            x, y, w, h = (stats[:, i].astype(np.float32) for i in range(4))
+            boxes = np.column_stack((x, y, x + w, y + h)).reshape(-1, 4)
+            detections.append(Detections(boxes, np.full(len(boxes), 0.9, np.float32), np.zeros(len(boxes), np.float32)))
+        return detections
+
+class StubPPEModel:
+    # Places hard-hat, vest and boots boxes at fixed positions of each crop, jittered per fold
+    LAYOUT = (
+        (0, (0.25, 0.0, 0.75, 0.15)),   # hard-hat
+        (5, (0.1, 0.25, 0.9, 0.6)),     # vest
+        (4, (0.1, 0.85, 0.9, 1.0)),     # boots
+    )
+
+    def __init__(self, fold=0, latency_per_call=0.0, latency_per_image=0.0, jitter=0.02):
+        self.latency_per_call = latency_per_call
+        self.latency_per_image = latency_per_image
+        offsets = np.random.default_rng(fold).uniform(-jitter, jitter, size=(len(self.LAYOUT), 4))
+        self.layout = np.array([box for _, box in self.LAYOUT]) + offsets
+        self.classes = np.array([cls for cls, _ in self.LAYOUT], dtype=np.float32)
+        self.scores = np.linspace(0.9, 0.7, len(self.LAYOUT), dtype=np.float32) - fold * 0.01
+
+    def __call__(self, images, imgsz=640):
+        _sleep(self.latency_per_call, self.latency_per_image, len(images))
+        detections = []
+        for image in images:
+            height, width = image.shape[:2]
+            boxes = (self.layout * np.array([width, height, width, height])).clip(0, [width, height, width, height])
+            detections.append(Detections(boxes.astype(np.float32), self.scores.copy(), self.classes.copy()))
+        return detections
+
+def load_stub_models(num_folds=5, person_latency=0.0, ppe_latency=0.0, per_image_latency=0.0):
+    person_model = StubPersonModel(person_latency, per_image_latency)
+    ppe_models = [StubPPEModel(fold, ppe_latency, per_image_latency) for fold in range(num_folds)]
+    return person_model, ppe_models
@@ -0,0 +1,48 @@
+# Synthetic site images for benchmarking: a noisy background with person-shaped blobs painted in PERSON_COLOR,
+# so the stub person model can find them again deterministically.
+
+import numpy as np
+import cv2
+
+PERSON_COLOR = (0, 0, 250)
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+def generate_image(width, height, num_persons, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 200, size=(height, width, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (7, 7), 0)
+
+    boxes = []
+    for _ in range(num_persons):
+        # Roughly person proportions, between a tenth and a third of the frame height
+        person_height = int(rng.uniform(0.1, 0.33) * height)
+        person_width = max(4, person_height // 3)
+        x1 = int(rng.integers(0, max(1, width - person_width)))
+        y1 = int(rng.integers(0, max(1, height - person_height)))
+        x2, y2 = x1 + person_width, y1 + person_height
+        cv2.rectangle(image, (x1, y1), (x2, y2), PERSON_COLOR, -1)
+        boxes.append([x1, y1, x2, y2])
+    return image, np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+def generate_dataset(resolutions, densities, images_per_case, seed=0):
+    # Encoded JPEGs, so the decode stage is measured like it is on real files
+    dataset = []
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for num_persons in densities:
+            for i in range(images_per_case):
+                image, _ = generate_image(width, height, num_persons, seed=seed + i)
+                success, encoded = cv2.imencode('.jpg', image)
+                if success:
+                    dataset.append({
+                        'name': f"{resolution}_{num_persons}p_{i}.jpg",
+                        'resolution': resolution,
+                        'persons': num_persons,
+                        'data': encoded.tobytes(),
+                    })
+    return dataset
@@ -0,0 +1,111 @@
+# End-to-end latency and memory of process_image with a full decode versus --person_imgsz
+# The reduced path still decodes at full resolution whenever persons are found or the image is drawn, so both
+# paths are timed through process_image (decode, person and PPE stages, drawing and encoding), with and without
+# rendering, and the net effect is reported rather than the person stage alone.
+# Usage: python -m benchmarks.two_resolution_benchmark [--input_dir <images>] [--person_imgsz 640]
+#        python -m benchmarks.two_resolution_benchmark --person_model weights/person.pt --ppe_models_dir weights/ppe_models
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from engines import BACKENDS, Detections, match_rate
+from inference import IMAGE_EXTENSIONS, load_models, process_image
+from benchmarks.stubs import load_stub_models
+from benchmarks.synthetic import generate_dataset
+
+class_mapping = {
+    0: 'hard-hat',
+    1: 'gloves',
+    2: 'mask',
+    3: 'glasses',
+    4: 'boots',
+    5: 'vest',
+    6: 'ppe-suit'
+}
+
+def measure(fn):
+    # Wall time and peak traced allocation (decoded images are NumPy arrays, so tracemalloc sees them)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def run_image(item, person_model, ppe_models, output_dir, person_imgsz, render):
+    # Rendered runs write the annotated image like a real run; without rendering the result record comes back
+    return process_image(item['data'], person_model, ppe_models, output_dir if render else None, class_mapping,
+                         name=item['name'], render=render, person_imgsz=person_imgsz)
+
+def person_detections(record):
+    boxes = np.asarray(record['person_boxes']).reshape(-1, 4)
+    return Detections(boxes, np.asarray(record['person_scores']), np.zeros(len(boxes)))
+
+def run(dataset, person_model, ppe_models, output_dir, person_imgsz):
+    rows = []
+    for item in dataset:
+        row = [item['name']]
+        records = []
+        for render in (True, False):
+            for imgsz in (0, person_imgsz):
+                result, seconds, peak = measure(lambda: run_image(item, person_model, ppe_models, output_dir, imgsz, render))
+                row += [seconds, peak]
+                if not render:
+                    records.append(result)
+        row.append(match_rate(person_detections(records[0]), person_detections(records[1]), score_tolerance=1.0))
+        rows.append(row)
+    return rows
+
+def load_dataset(input_dir):
+    dataset = []
+    for file in sorted(os.listdir(input_dir)):
+        if file.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(input_dir, file), 'rb') as f:
+                dataset.append({'name': file, 'data': f.read()})
+    return dataset
+
+def summary(label, full_seconds, reduced_seconds, full_peak, reduced_peak):
+    return (f"{label}: {full_seconds * 1000:.1f} ms -> {reduced_seconds * 1000:.1f} ms "
+            f"({(1 - reduced_seconds / full_seconds) * 100:.0f}% faster), peak memory {full_peak / 1e6:.1f} MB -> "
+            f"{reduced_peak / 1e6:.1f} MB ({(1 - reduced_peak / full_peak) * 100:.0f}% less)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare process_image with and without a reduced-resolution person stage.")
+    parser.add_argument('--input_dir', help="Images to measure (default: synthetic 4K images).")
+    parser.add_argument('--person_imgsz', type=int, default=640, help="Person-stage input size of the reduced path.")
+    parser.add_argument('--images', type=int, default=5, help="Synthetic images per person density.")
+    parser.add_argument('--person_model', help="Use the real person model instead of the stub.")
+    parser.add_argument('--ppe_models_dir', help="Directory with the real ppe_fold_* models.")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Engine for the real models.")
+    args = parser.parse_args()
+
+    if args.person_model and args.ppe_models_dir:
+        person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend)
+    else:
+        person_model, ppe_models = load_stub_models()
+    dataset = load_dataset(args.input_dir) if args.input_dir else generate_dataset(['4k'], [1, 5, 20], args.images)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Warm up both paths once
+        run(dataset[:1], person_model, ppe_models, output_dir, args.person_imgsz)
+        rows = run(dataset, person_model, ppe_models, output_dir, args.person_imgsz)
+
+    print(f"{'':<24} {'rendered':^49} {'no render':^49}")
+    print(f"{'image':<24}" + f" {'full (ms)':>10} {'reduced (ms)':>13} {'full (MB)':>10} {'reduced (MB)':>13}" * 2
+          + f" {'agreement':>10}")
+    for name, *values in rows:
+        print(f"{name:<24}" + ''.join(f" {values[i] * 1000:>10.1f} {values[i + 2] * 1000:>13.1f} "
+                                      f"{values[i + 1] / 1e6:>10.1f} {values[i + 3] / 1e6:>13.1f}" for i in (0, 4))
+              + f" {values[8]:>10.2f}")
+
+    means = np.array([row[1:] for row in rows]).mean(axis=0)
+    print(summary("process_image, rendered", means[0], means[2], means[1], means[3]))
+    print(summary("process_image, no render", means[4], means[6], means[5], means[7]))
+    print(f"Person box agreement {means[8]:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Early-exit cascade over the PPE fold models
+# The folds run in a configured order; when the first min_folds folds agree on a crop (every confident box has a
+# same-class partner above the IoU threshold with a close score) their fused result is used and the remaining
+# folds are skipped. Only ambiguous crops fall through to the full ensemble. A random sample of the early exits
+# is also run through the full ensemble to measure how often the early result agrees with it.
+
+import random
+import threading
+import numpy as np
+from engines import Detections, match_rate
+
+def _detections(predictions):
+    predictions = np.asarray(predictions, dtype=np.float64).reshape(-1, 6)
+    return Detections(predictions[:, :4], predictions[:, 4], predictions[:, 5])
+
+class FoldCascade(list):
+    # The fold models in cascade order; pass it wherever the list of PPE models goes
+    def __init__(self, models, order=None, min_folds=2, iou_threshold=0.5, score_tolerance=0.1, score_threshold=0.5,
+                 audit_rate=0.05, seed=0):
+        if order:
+            if sorted(order) != list(range(len(models))):
+                raise ValueError(f"Cascade order {order} is not a permutation of the {len(models)} folds")
+            models = [models[i] for i in order]
+        super().__init__(models)
+        self.order = list(order) if order else list(range(len(models)))
+        self.min_folds = max(1, min(min_folds, len(models)))
+        self.iou_threshold = iou_threshold
+        self.score_tolerance = score_tolerance
+        self.score_threshold = score_threshold
+        self.audit_rate = audit_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.crops = 0
+        self.folds_evaluated = 0
+        self.early_exits = 0
+        self.audited = 0
+        self.audit_agreed = 0
+
+    def __repr__(self):
+        return (f"FoldCascade(order={self.order}, min_folds={self.min_folds}, iou_threshold={self.iou_threshold}, "
+                f"score_tolerance={self.score_tolerance}, score_threshold={self.score_threshold})")
+
+    def _same(self, a, b):
+        return (match_rate(a, b, self.iou_threshold, self.score_tolerance) == 1.0 and
+                match_rate(b, a, self.iou_threshold, self.score_tolerance) == 1.0)
+
+    def agree(self, fold_predictions):
+        # fold_predictions: one (n, 6) array per evaluated fold; only boxes that would survive fusion count
+        confident = [_detections(p[p[:, 4] >= self.score_threshold]) for p in fold_predictions]
+        return all(self._same(confident[0], other) for other in confident[1:])
+
+    def sample_audit(self):
+        with self._lock:
+            return self.audit_rate > 0 and self._random.random() < self.audit_rate
+
+    def record(self, crops, early_exits, folds_evaluated):
+        with self._lock:
+            self.crops += crops
+            self.early_exits += early_exits
+            self.folds_evaluated += folds_evaluated
+
+    def record_audit(self, early_result, full_result):
+        early = Detections(*(np.asarray(a, dtype=np.float64) for a in early_result))
+        full = Detections(*(np.asarray(a, dtype=np.float64) for a in full_result))
+        agreed = self._same(Detections(early.boxes.reshape(-1, 4), early.scores, early.classes),
+                            Detections(full.boxes.reshape(-1, 4), full.scores, full.classes))
+        with self._lock:
+            self.audited += 1
+            self.audit_agreed += agreed
+
+    def stats(self):
+        return {
+            'crops': self.crops,
+            'folds_evaluated': self.folds_evaluated,
+            'early_exits': self.early_exits,
+            'audited': self.audited,
+            'audit_agreed': self.audit_agreed,
+        }
+
+def cascade_summary(stats, num_folds):
+    crops = stats['crops']
+    folds_per_crop = stats['folds_evaluated'] / crops if crops else 0.0
+    early_rate = stats['early_exits'] / crops * 100 if crops else 0.0
+    summary = (f"Fold cascade: {folds_per_crop:.2f} of {num_folds} folds per crop on average, "
+               f"{early_rate:.1f}% of {crops} crops exited early")
+    if stats['audited']:
+        summary += (f", agreement with the full ensemble {stats['audit_agreed'] / stats['audited'] * 100:.1f}% "
+                    f"on {stats['audited']} audited crops")
+    return summary
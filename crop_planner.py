@@ -0,0 +1,96 @@
+# Crop planning for the PPE stage
+# Person boxes that overlap heavily (groups of workers standing together) are merged into one region so the
+# ensemble runs once per region instead of once per person, as long as the region stays within max_region_size.
+# PPE detections of a merged region are handed back to the person box that contains most of them.
+# Degenerate and tiny person boxes are dropped before they reach the models.
+
+import numpy as np
+
+def _area(boxes):
+    return np.maximum(0, boxes[..., 2] - boxes[..., 0]) * np.maximum(0, boxes[..., 3] - boxes[..., 1])
+
+def _intersection(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    return np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+
+class CropPlanner:
+    def __init__(self, min_size=16, max_region_size=640, merge_overlap=0.3, min_containment=0.5):
+        self.min_size = min_size
+        self.max_region_size = max_region_size
+        self.merge_overlap = merge_overlap
+        self.min_containment = min_containment
+        self.persons = 0
+        self.dropped = 0
+        self.regions = 0
+
+    def __repr__(self):
+        return (f"CropPlanner(min_size={self.min_size}, max_region_size={self.max_region_size}, "
+                f"merge_overlap={self.merge_overlap}, min_containment={self.min_containment})")
+
+    def plan(self, person_boxes, image_shape):
+        # Returns [(region_box, member_indices)] with integer region boxes clipped to the image
+        height, width = image_shape[:2]
+        boxes = np.asarray(person_boxes, dtype=np.float64).reshape(-1, 4).copy()
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        keep = np.flatnonzero(((boxes[:, 2] - boxes[:, 0]) >= max(self.min_size, 1)) &
+                              ((boxes[:, 3] - boxes[:, 1]) >= max(self.min_size, 1)))
+
+        # Greedy, largest boxes first: a person joins the first region it overlaps enough that can still grow to hold it
+        regions = []
+        for index in keep[np.argsort(-_area(boxes[keep]), kind='stable')]:
+            box = boxes[index]
+            for region in regions:
+                merged = np.concatenate((np.minimum(region[0][:2], box[:2]), np.maximum(region[0][2:], box[2:])))
+                fits = max(merged[2] - merged[0], merged[3] - merged[1]) <= self.max_region_size
+                if fits and _intersection(box, region[0][None])[0] >= self.merge_overlap * _area(box):
+                    region[0] = merged
+                    region[1].append(int(index))
+                    break
+            else:
+                regions.append([box.copy(), [int(index)]])
+
+        self.persons += len(boxes)
+        self.dropped += len(boxes) - len(keep)
+        self.regions += len(regions)
+        return [(np.floor(region_box[:2]).tolist() + np.ceil(region_box[2:]).tolist(), members)
+                for region_box, members in regions]
+
+    def assign(self, person_boxes, regions, region_results):
+        # Per-person ensemble results, relative to each person's crop offset like crop_persons/offset_ppe_results
+        boxes = np.asarray(person_boxes, dtype=np.float64).reshape(-1, 4)
+        offsets = [(int(x1), int(y1)) for x1, y1, _, _ in boxes]
+        assigned = [[] for _ in boxes]
+
+        for (region_box, members), (ppe_boxes, ppe_scores, ppe_classes) in zip(regions, region_results):
+            if len(ppe_boxes) == 0:
+                continue
+            detections = np.asarray(ppe_boxes, dtype=np.float64).reshape(-1, 4) + np.tile(region_box[:2], 2)
+            if len(members) == 1:
+                owners = np.full(len(detections), members[0])
+            else:
+                # Share of each detection inside each member box; detections mostly outside every member are background
+                containment = np.stack([_intersection(boxes[m], detections) for m in members], axis=1)
+                containment /= np.maximum(_area(detections), 1e-9)[:, None]
+                best = containment.argmax(axis=1)
+                owners = np.where(containment[np.arange(len(detections)), best] >= self.min_containment,
+                                  np.asarray(members)[best], -1)
+            for detection, score, cls, owner in zip(detections, ppe_scores, ppe_classes, owners):
+                if owner >= 0:
+                    assigned[owner].append((detection - np.tile(offsets[owner], 2), score, cls))
+
+        ensemble_results = []
+        for detections in assigned:
+            if not detections:
+                ensemble_results.append((np.array([]), np.array([]), np.array([])))
+            else:
+                ppe_boxes, ppe_scores, ppe_classes = zip(*detections)
+                ensemble_results.append((np.array(ppe_boxes), np.array(ppe_scores), np.array(ppe_classes)))
+        return offsets, ensemble_results
+
+    def summary(self):
+        return (f"Crop planner: {self.persons} persons, {self.dropped} tiny or degenerate crops dropped, "
+                f"{self.regions} regions sent to the PPE ensemble")
@@ -2,25 +2,23 @@
 # Usage: python clean_cropped_dataset.py <label_dir> <image_dir>
 import os
 import argparse, sys
+from label_index import load_label_index
 
 def clear_empty_labels(label_dir, image_dir):
-    # Iterate through all label files in the label directory
-    for label_file in os.listdir(label_dir):
-        if label_file.endswith(".txt"):
-            label_path = os.path.join(label_dir, label_file)
-            
-            # Check if the label file is empty
-            if os.path.getsize(label_path) == 0:
-                # Construct the corresponding image file path
-                image_file = label_file.replace(".txt", ".jpg")
-                image_path = os.path.join(image_dir, image_file)
-                
-                # Delete the empty label file and the corresponding image
-                print(f"Deleting {label_path} and {image_path}")
-                os.remove(label_path)
-                
-                if os.path.exists(image_path):
-                    os.remove(image_path)
+    index = load_label_index(label_dir)
+    # Empty label files are the zero-size entries of the index
+    for label_file in index.files[index.sizes == 0].tolist():
+        label_path = os.path.join(label_dir, label_file)
+        # Construct the corresponding image file path
+        image_file = label_file.replace(".txt", ".jpg")
+        image_path = os.path.join(image_dir, image_file)
+
+        # Delete the empty label file and the corresponding image
+        print(f"Deleting {label_path} and {image_path}")
+        os.remove(label_path)
+
+        if os.path.exists(image_path):
+            os.remove(image_path)
 
 
 def main():
@@ -1,38 +1,29 @@
 # script to count instances of each class in YOLO format labels
 # Usage: python count_instances.py <labels_dir>
+# labels_dir may also be a packed dataset (see packed_dataset.py); its labels are already parsed there.
 
-import os
-from collections import Counter
+import numpy as np
 import pandas as pd
 import argparse
 import sys
+from label_index import load_label_index
+from packed_dataset import PackedDataset, is_packed
 
 def count_class_instances(labels_dir):
-    class_counter = Counter()
-    image_counter = Counter()
-    total_images = 0
+    index = PackedDataset(labels_dir) if is_packed(labels_dir) else load_label_index(labels_dir)
+    total_images = len(index)
 
-    for label_file in os.listdir(labels_dir):
-        if label_file.endswith('.txt'):
-            total_images += 1
-            image_classes = set()
-            
-            with open(os.path.join(labels_dir, label_file), 'r') as f:
-                for line in f:
-                    class_id = int(line.split()[0])
-                    class_counter[class_id] += 1
-                    image_classes.add(class_id)
-            
-            for class_id in image_classes:
-                image_counter[class_id] += 1
+    class_ids, instances = np.unique(index.classes, return_counts=True)
+    # Each distinct (image, class) pair is one image containing that class
+    pairs = np.unique(np.stack((index.image, index.classes), axis=1), axis=0)
+    images_with_class = np.unique(pairs[:, 1], return_counts=True)[1]
 
     # Create a DataFrame for better visualization
     df = pd.DataFrame({
-        'Class ID': class_counter.keys(),
-        'Total Instances': class_counter.values(),
-        'Images with Class': image_counter.values(),
-        'Avg Instances per Image': [count / image_counter[class_id] if image_counter[class_id] > 0 else 0 
-                                    for class_id, count in class_counter.items()]
+        'Class ID': class_ids,
+        'Total Instances': instances,
+        'Images with Class': images_with_class,
+        'Avg Instances per Image': instances / images_with_class,
     })
     
     df = df.sort_values('Total Instances', ascending=False).reset_index(drop=True)
@@ -50,7 +41,7 @@ def count_class_instances(labels_dir):
 
 def main():
     parser = argparse.ArgumentParser(description="Count instances of each class in YOLO format labels.")
-    parser.add_argument('labels_dir', type=str, nargs='?', help="Path to the directory containing YOLO format label files.")
+    parser.add_argument('labels_dir', type=str, nargs='?', help="Path to the directory containing YOLO format label files, or a packed dataset.")
     args = parser.parse_args()
 
     if not args.labels_dir:
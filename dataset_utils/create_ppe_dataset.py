@@ -1,94 +1,286 @@
 # script to convert YOLO format annotations for person detection to cropped images
-# Usage: python convert_annotations.py <input_dir> <output_dir>
+# Usage: python create_ppe_dataset.py <input_dir> <output_dir> [--workers N] [--incremental]
+#
+# Every person box becomes a cropped image, labelled with the PPE items that lie fully inside it.
+# Each label file is parsed once into an array, and the containment of all items in all person boxes is a single
+# vectorised comparison. Images are spread over a process pool in chunks; within a chunk the crops of one image are
+# written by a few threads while the next image is decoded.
+# --incremental skips source images converted since the image and its label file last changed, going by
+# crop_manifest.sqlite in output_dir, which records the crops each image wrote.
+# input_dir may also be a packed dataset (see packed_dataset.py), read straight from its shards.
 
 import os
+import sqlite3
 import cv2
 import numpy as np
-from pathlib import Path
-import sys, argparse
+import sys, argparse, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from packed_dataset import PackedDataset, is_packed
 
-def convert_annotations(input_dir, output_dir):
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+MANIFEST_NAME = 'crop_manifest.sqlite'
+
+def read_labels(label_path):
+    # (n, 5) array of class_id, x_center, y_center, width, height
+    with open(label_path, 'r') as f:
+        values = f.read().split()
+    return np.array(values, dtype=np.float64).reshape(-1, 5)
+
+def to_corners(labels, width, height):
+    x_center, y_center, w, h = labels[:, 1], labels[:, 2], labels[:, 3], labels[:, 4]
+    return (x_center - w/2) * width, (y_center - h/2) * height, (x_center + w/2) * width, (y_center + h/2) * height
+
+def crop_labels(labels, width, height):
+    # Person crop boxes in pixels, and the label lines of each crop
+    persons = labels[labels[:, 0] == 0]
+    items = labels[labels[:, 0] != 0]
+    # Truncated towards zero like int(), so the crops match what the dataset was generated with before
+    px1, py1, px2, py2 = (np.trunc(c).astype(int) for c in to_corners(persons, width, height))
+    ix1, iy1, ix2, iy2 = to_corners(items, width, height)
+
+    # inside[p, i]: item i lies fully within person box p
+    inside = ((px1[:, None] <= ix1) & (ix1 < ix2) & (ix2 <= px2[:, None]) &
+              (py1[:, None] <= iy1) & (iy1 < iy2) & (iy2 <= py2[:, None]))
+
+    boxes = np.stack((px1, py1, px2, py2), axis=1)
+    # Crop size after the slice is clipped to the image, as in img[y1:y2, x1:x2].shape
+    crop_widths = [len(range(width)[x1:x2]) for x1, x2 in zip(px1.tolist(), px2.tolist())]
+    crop_heights = [len(range(height)[y1:y2]) for y1, y2 in zip(py1.tolist(), py2.tolist())]
+
+    crop_lines = []
+    for person, (x1, y1) in enumerate(zip(px1.tolist(), py1.tolist())):
+        selected = inside[person]
+        crop_width, crop_height = crop_widths[person], crop_heights[person]
+        if not selected.any() or not crop_width or not crop_height:
+            crop_lines.append([])
+            continue
+        new_x = (ix1[selected] - x1) / crop_width
+        new_y = (iy1[selected] - y1) / crop_height
+        new_w = items[selected, 3] * width / crop_width
+        new_h = items[selected, 4] * height / crop_height
+        crop_lines.append([
+            f"{class_id - 1} {x + w/2} {y + h/2} {w} {h}"
+            for class_id, x, y, w, h in zip(items[selected, 0].astype(int).tolist(), new_x.tolist(), new_y.tolist(),
+                                             new_w.tolist(), new_h.tolist())
+        ])
+    return boxes, crop_lines
+
+def output_paths(stem, person_count, output_images_dir, output_labels_dir):
+    return (os.path.join(output_images_dir, f"{stem}_{person_count}.jpg"),
+            os.path.join(output_labels_dir, f"{stem}_{person_count}.txt"))
+
+def up_to_date(stem, converted, source_mtime, output_images_dir, output_labels_dir):
+    # converted is the manifest entry of the image: (person numbers whose crops were written, conversion time).
+    # Empty or degenerate crops are never written, so only the recorded ones have to exist.
+    if converted is None or converted[1] < source_mtime:
+        return False
+    return all(os.path.exists(path) for person_count in converted[0]
+               for path in output_paths(stem, person_count, output_images_dir, output_labels_dir))
+
+class CropManifest:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS converted ("
+            "image TEXT PRIMARY KEY, persons TEXT NOT NULL, converted_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def entries(self):
+        return {image: ([int(person) for person in persons.split()], converted_at) for image, persons, converted_at in
+                self._db.execute("SELECT image, persons, converted_at FROM converted")}
+
+    def mark(self, image, persons, converted_at):
+        self._db.execute("INSERT OR REPLACE INTO converted (image, persons, converted_at) VALUES (?, ?, ?)",
+                         (image, ' '.join(map(str, persons)), converted_at))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+def write_crop(img_path, cropped_img, label_path, lines):
+    if not cv2.imwrite(img_path, cropped_img):
+        raise IOError(f"Could not write {img_path}")
+    with open(label_path, 'w') as f:
+        f.write('\n'.join(lines))
+
+def write_crops(img, labels, stem, img_name, output_images_dir, output_labels_dir, writer):
+    height, width = img.shape[:2]
+    boxes, crop_lines = crop_labels(labels, width, height)
+    written = []
+    futures = []
+    for person_count, ((x1, y1, x2, y2), lines) in enumerate(zip(boxes.tolist(), crop_lines), start=1):
+        cropped_img = img[y1:y2, x1:x2]
+        if cropped_img.size == 0:
+            print(f"Empty crop for person {person_count} in {img_name}. Skipping.")
+            continue
+        crop_path, crop_label_path = output_paths(stem, person_count, output_images_dir, output_labels_dir)
+        futures.append(writer.submit(write_crop, crop_path, cropped_img, crop_label_path, lines))
+        written.append(person_count)
+    return 'done', written, futures
+
+def convert_image(img_file, input_images_dir, input_labels_dir, output_images_dir, output_labels_dir, converted,
+                  writer):
+    # Returns (status, person numbers of the crops submitted for writing, write futures).
+    # converted is the image's manifest entry with --incremental, None otherwise.
+    stem = img_file.rsplit('.', 1)[0]
+    img_path = os.path.join(input_images_dir, img_file)
+    label_path = os.path.join(input_labels_dir, stem + '.txt')
+    if not os.path.exists(label_path):
+        return 'no_label', [], []
+
+    labels = read_labels(label_path)
+    num_persons = int((labels[:, 0] == 0).sum())
+    # Images without persons produce nothing, so they are not even decoded
+    if num_persons == 0:
+        return 'no_persons', [], []
+    if converted is not None and up_to_date(stem, converted, max(os.path.getmtime(img_path), os.path.getmtime(label_path)),
+                                            output_images_dir, output_labels_dir):
+        return 'up_to_date', [], []
+
+    img = cv2.imread(img_path)
+    if img is None:
+        return 'unreadable', [], []
+    return write_crops(img, labels, stem, img_file, output_images_dir, output_labels_dir, writer)
+
+def convert_packed_image(packed, i, output_images_dir, output_labels_dir, converted, writer):
+    # Same as convert_image for image i of a packed dataset; the pack itself is the source mtime
+    img_file = str(packed.names[i])
+    stem = img_file.rsplit('.', 1)[0]
+    labels = packed.label_rows(i)
+    num_persons = int((labels[:, 0] == 0).sum())
+    if num_persons == 0:
+        return 'no_persons', [], []
+    if converted is not None and up_to_date(stem, converted, os.path.getmtime(os.path.join(packed.path, 'meta.json')),
+                                            output_images_dir, output_labels_dir):
+        return 'up_to_date', [], []
+
+    img = packed.decode_image(i)
+    if img is None:
+        return 'unreadable', [], []
+    return write_crops(img, labels, stem, img_file, output_images_dir, output_labels_dir, writer)
+
+_packed_inputs = {}
+
+def open_packed(input_dir):
+    # One PackedDataset per process for all the chunks it converts, None for a loose images/labels directory
+    if input_dir not in _packed_inputs:
+        _packed_inputs[input_dir] = PackedDataset(input_dir) if is_packed(input_dir) else None
+    return _packed_inputs[input_dir]
+
+def convert_chunk(img_files, converted, input_dir, output_dir, write_threads=2):
+    # One process pool task: a chunk of images, with the crop writes of each image overlapping the next decode.
+    # For a packed input_dir the chunk holds image indices into the pack instead of file names.
+    # converted holds the manifest entries of the chunk's images by file name, empty without --incremental.
+    cv2.setNumThreads(1)
     input_images_dir = os.path.join(input_dir, 'images')
     input_labels_dir = os.path.join(input_dir, 'labels')
     output_images_dir = os.path.join(output_dir, 'images')
     output_labels_dir = os.path.join(output_dir, 'labels')
+    packed = open_packed(input_dir)
+
+    results = []
+    pending = []
+    with ThreadPoolExecutor(max_workers=write_threads) as writer:
+        for img_file in img_files:
+            if packed is not None:
+                i, img_file = img_file, str(packed.names[img_file])
+                status, written, futures = convert_packed_image(packed, i, output_images_dir, output_labels_dir,
+                                                                converted.get(img_file), writer)
+            else:
+                status, written, futures = convert_image(img_file, input_images_dir, input_labels_dir, output_images_dir,
+                                                         output_labels_dir, converted.get(img_file), writer)
+            # At most one image's crops are waiting, which bounds the memory held by pending writes
+            for future in wait(pending).done:
+                future.result()
+            pending = futures
+            results.append((img_file, status, written))
+        for future in wait(pending).done:
+            future.result()
+    return results
+
+def convert_annotations(input_dir, output_dir, workers=None, incremental=False, chunk_size=16, write_threads=2):
+    input_images_dir = os.path.join(input_dir, 'images')
+    output_images_dir = os.path.join(output_dir, 'images')
+    output_labels_dir = os.path.join(output_dir, 'labels')
 
     os.makedirs(output_images_dir, exist_ok=True)
     os.makedirs(output_labels_dir, exist_ok=True)
 
-    for img_file in os.listdir(input_images_dir):
-        if img_file.endswith(('.jpg', '.png', '.jpeg')):
-            img_path = os.path.join(input_images_dir, img_file)
-            label_path = os.path.join(input_labels_dir, img_file.rsplit('.', 1)[0] + '.txt')
-
-            if not os.path.exists(label_path):
-                print(f"No label file found for {img_file}. Skipping.")
-                continue
-
-            img = cv2.imread(img_path)
-            height, width = img.shape[:2]
-
-            with open(label_path, 'r') as f:
-                annotations = [line.strip().split() for line in f]
-
-            person_count = 0
-            for ann in annotations:
-                if ann[0] == '0':  # Assuming '0' is the class ID for person
-                    person_count += 1
-                    x_center, y_center, w, h = map(float, ann[1:])
-                    x1 = int((x_center - w/2) * width)
-                    y1 = int((y_center - h/2) * height)
-                    x2 = int((x_center + w/2) * width)
-                    y2 = int((y_center + h/2) * height)
-
-                    # Crop the image
-                    cropped_img = img[y1:y2, x1:x2]
-                    crop_height, crop_width = cropped_img.shape[:2]
-
-                    # Create new annotations for the cropped image
-                    new_annotations = []
-                    for item in annotations:
-                        class_id = int(item[0])
-                        if class_id != 0:  # Skip person class
-                            item_x, item_y, item_w, item_h = map(float, item[1:])
-                            item_x1 = (item_x - item_w/2) * width
-                            item_y1 = (item_y - item_h/2) * height
-                            item_x2 = (item_x + item_w/2) * width
-                            item_y2 = (item_y + item_h/2) * height
-
-                            # Check if the item is inside the person's bounding box
-                            if x1 <= item_x1 < item_x2 <= x2 and y1 <= item_y1 < item_y2 <= y2:
-                                # Adjust coordinates relative to the cropped image
-                                new_x = (item_x1 - x1) / crop_width
-                                new_y = (item_y1 - y1) / crop_height
-                                new_w = item_w * width / crop_width
-                                new_h = item_h * height / crop_height
-
-                                new_annotations.append(f"{class_id-1} {new_x + new_w/2} {new_y + new_h/2} {new_w} {new_h}")
-
-                    # Save the cropped image
-                    output_img_path = os.path.join(output_images_dir, f"{img_file.rsplit('.', 1)[0]}_{person_count}.jpg")
-                    cv2.imwrite(output_img_path, cropped_img)
-
-                    # Save the new annotations
-                    output_label_path = os.path.join(output_labels_dir, f"{img_file.rsplit('.', 1)[0]}_{person_count}.txt")
-                    with open(output_label_path, 'w') as f:
-                        f.write('\n'.join(new_annotations))
-
-    print("Conversion completed.")
+    packed = open_packed(input_dir)
+    if packed is not None:
+        # Pack order is shard order, so each chunk reads one stretch of a shard
+        img_files = list(range(len(packed)))
+        names = [str(name) for name in packed.names]
+    else:
+        img_files = sorted(f for f in os.listdir(input_images_dir) if f.endswith(IMAGE_EXTENSIONS))
+        names = img_files
+    chunks = [img_files[i:i + chunk_size] for i in range(0, len(img_files), chunk_size)]
+
+    manifest = CropManifest(os.path.join(output_dir, MANIFEST_NAME))
+    entries = manifest.entries() if incremental else {}
+    # Each chunk only carries the manifest entries of its own images
+    chunk_converted = [{name: entries[name] for name in names[i:i + chunk_size] if name in entries}
+                       for i in range(0, len(img_files), chunk_size)]
+    convert = partial(convert_chunk, input_dir=input_dir, output_dir=output_dir, write_threads=write_threads)
+
+    workers = workers or os.cpu_count() or 1
+    counts = {'done': 0, 'no_persons': 0, 'up_to_date': 0, 'no_label': 0, 'unreadable': 0}
+    crops = 0
+    # Recorded as the conversion time, so a source changed while the run was going is converted again next time
+    run_started = time.time()
+    start = time.perf_counter()
+    if workers == 1:
+        chunk_results = map(convert, chunks, chunk_converted)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunk_results = executor.map(convert, chunks, chunk_converted)
+    try:
+        for results in chunk_results:
+            # A chunk's results arrive after all its crops are written, so the manifest never runs ahead of the files
+            for img_file, status, written in results:
+                counts[status] += 1
+                crops += len(written)
+                if status == 'done':
+                    manifest.mark(img_file, written, run_started)
+                elif status == 'no_label':
+                    print(f"No label file found for {img_file}. Skipping.")
+                elif status == 'unreadable':
+                    print(f"Could not read {img_file}. Skipping.")
+            manifest.commit()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Conversion completed: {counts['done']} images converted into {crops} crops, {counts['no_persons']} without "
+          f"persons, {counts['up_to_date']} already up to date, {counts['no_label'] + counts['unreadable']} skipped "
+          f"in {elapsed:.1f}s ({len(img_files) / elapsed if elapsed > 0 else 0.0:.1f} images/sec)")
+    return counts, crops
 
 def main():
     parser = argparse.ArgumentParser(description="Convert YOLO format annotations for person detection to cropped images.")
-    parser.add_argument('input_dir', type=str, help="Path to the input directory containing images and labels.")
+    parser.add_argument('input_dir', type=str, help="Path to the input directory containing images and labels, or a packed dataset.")
     parser.add_argument('output_dir', type=str, help="Path to the output directory to save cropped images and labels.")
+    parser.add_argument('--workers', type=int, default=0, help="Worker processes (default: one per CPU core).")
+    parser.add_argument('--incremental', action='store_true', help="Skip images converted since the image and its labels last changed.")
+    parser.add_argument('--chunk_size', type=int, default=16, help="Images per process pool task.")
+    parser.add_argument('--write_threads', type=int, default=2, help="Threads per worker writing the crops of an image.")
     args = parser.parse_args()
 
     if not args.input_dir or not args.output_dir:
         print("Error: Both input_dir and output_dir arguments are required.")
         print("Usage: python script_name.py <input_dir> <output_dir>")
         sys.exit(1)
-    
-    convert_annotations(args.input_dir, args.output_dir)
+
+    convert_annotations(args.input_dir, args.output_dir, args.workers, args.incremental, args.chunk_size,
+                        args.write_threads)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
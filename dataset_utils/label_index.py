@@ -0,0 +1,175 @@
+# shared loader for directories of YOLO format label files
+# A labels directory is scanned once and parsed in parallel into NumPy columns, one row per box:
+#   image (index into files), classes, boxes (x_center, y_center, width, height) and the byte range of the line,
+# plus per label file its name, mtime and size. The columns are saved as .npy files in <labels_dir>.index/ and
+# memory-mapped on later loads; the index is rebuilt when a label file is added, removed or its mtime or size changes.
+# Usage: python label_index.py <labels_dir>        (builds or refreshes the index and prints a summary)
+
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+INDEX_VERSION = 1
+# Below this many files the process pool costs more than it saves
+PARALLEL_MIN_FILES = 2000
+FILE_COLUMNS = ('files', 'mtimes', 'sizes')
+BOX_COLUMNS = ('image', 'classes', 'boxes', 'offsets', 'lengths')
+NAN_BOX = [b'nan'] * 4
+
+def index_path(labels_dir):
+    return os.path.normpath(labels_dir) + '.index'
+
+def scan_labels(labels_dir):
+    entries = sorted((entry.name, entry.stat()) for entry in os.scandir(labels_dir)
+                     if entry.name.endswith('.txt') and entry.is_file())
+    return {
+        'files': np.array([name for name, _ in entries], dtype=str),
+        'mtimes': np.array([stat.st_mtime_ns for _, stat in entries], dtype=np.int64),
+        'sizes': np.array([stat.st_size for _, stat in entries], dtype=np.int64),
+    }
+
+def parse_label_file(path):
+    # Returns class, box, line offset and line length of every non-blank line
+    with open(path, 'rb') as f:
+        data = f.read()
+    classes, boxes, offsets, lengths = [], [], [], []
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        values = line.split()
+        if values:
+            classes.append(values[0])
+            # Only plain boxes have a box; segment labels keep their class and NaN coordinates
+            boxes.append(values[1:5] if len(values) == 5 else NAN_BOX)
+            offsets.append(offset)
+            lengths.append(len(line))
+        offset += len(line)
+    return classes, boxes, offsets, lengths
+
+def _parse_files(labels_dir, names):
+    classes, boxes, offsets, lengths, counts = [], [], [], [], []
+    for name in names:
+        file_classes, file_boxes, file_offsets, file_lengths = parse_label_file(os.path.join(labels_dir, name))
+        classes += file_classes
+        boxes += file_boxes
+        offsets += file_offsets
+        lengths += file_lengths
+        counts.append(len(file_classes))
+    return {
+        'classes': np.array(classes, dtype=bytes).astype(np.float64).astype(np.int32),
+        'boxes': np.array(boxes, dtype=bytes).reshape(-1, 4).astype(np.float64),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'lengths': np.array(lengths, dtype=np.int32),
+        'counts': np.array(counts, dtype=np.int64),
+    }
+
+def parse_labels(labels_dir, files, workers=None):
+    names = files.tolist()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(names) < PARALLEL_MIN_FILES:
+        chunks = [_parse_files(labels_dir, names)]
+    else:
+        chunk_size = -(-len(names) // (workers * 4))
+        name_chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_parse_files, [labels_dir] * len(name_chunks), name_chunks))
+    counts = np.concatenate([chunk['counts'] for chunk in chunks])
+    columns = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in ('classes', 'boxes', 'offsets', 'lengths')}
+    columns['boxes'] = columns['boxes'].reshape(-1, 4)
+    columns['image'] = np.repeat(np.arange(len(names), dtype=np.int32), counts)
+    return columns
+
+def save_columns(path, labels_dir, columns):
+    # Written next to the final location and swapped in, so a reader never maps half an index
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for key in FILE_COLUMNS + BOX_COLUMNS:
+        np.save(os.path.join(tmp_path, key + '.npy'), columns[key])
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'labels_dir': os.path.abspath(labels_dir)}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+def load_columns(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            if json.load(f).get('version') != INDEX_VERSION:
+                return None
+        return {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in FILE_COLUMNS + BOX_COLUMNS}
+    except (OSError, ValueError):
+        return None
+
+class LabelIndex:
+    def __init__(self, labels_dir, columns):
+        self.labels_dir = labels_dir
+        for key in FILE_COLUMNS + BOX_COLUMNS:
+            setattr(self, key, columns[key])
+
+    def __len__(self):
+        return len(self.files)
+
+    def stems(self):
+        return [name[:-len('.txt')] for name in self.files.tolist()]
+
+    def label_path(self, file_index):
+        return os.path.join(self.labels_dir, str(self.files[file_index]))
+
+    def boxes_per_file(self, mask=None):
+        image = self.image if mask is None else self.image[mask]
+        return np.bincount(image, minlength=len(self.files))
+
+    def read_lines(self, file_index, rows):
+        # The original bytes of the given box rows of one label file
+        with open(self.label_path(file_index), 'rb') as f:
+            data = f.read()
+        return b''.join(data[offset:offset + length] for offset, length in zip(self.offsets[rows].tolist(), self.lengths[rows].tolist()))
+
+    def write_labels(self, keep, output_dir, write_empty=False, files=None):
+        # Writes the kept lines of each label file to output_dir unchanged; returns the indices of the files written.
+        # files limits the output to those file indices, write_empty also writes files with no kept lines.
+        os.makedirs(output_dir, exist_ok=True)
+        kept = np.flatnonzero(keep)
+        counts = np.bincount(self.image[kept], minlength=len(self.files))
+        # Rows are ordered by file, so the kept rows of each file are one contiguous run
+        groups = np.split(kept, np.cumsum(counts)[:-1]) if len(self.files) else []
+        candidates = np.arange(len(self.files)) if files is None else np.asarray(files, dtype=np.int64)
+        if not write_empty:
+            candidates = candidates[counts[candidates] > 0]
+        for file_index in candidates.tolist():
+            rows = groups[file_index]
+            with open(os.path.join(output_dir, str(self.files[file_index])), 'wb') as f:
+                f.write(self.read_lines(file_index, rows) if len(rows) else b'')
+        return candidates
+
+def load_label_index(labels_dir, workers=None, rebuild=False):
+    path = index_path(labels_dir)
+    scanned = scan_labels(labels_dir)
+    columns = None if rebuild else load_columns(path)
+    if columns is not None and all(np.array_equal(columns[key], scanned[key]) for key in FILE_COLUMNS):
+        return LabelIndex(labels_dir, columns)
+
+    columns = dict(scanned, **parse_labels(labels_dir, scanned['files'], workers))
+    try:
+        save_columns(path, labels_dir, columns)
+        columns = load_columns(path) or columns
+    except OSError as e:
+        # A read-only dataset still gets the in-memory index
+        print(f"Could not save the label index to {path}: {e}")
+    return LabelIndex(labels_dir, columns)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the cached index of a YOLO labels directory.")
+    parser.add_argument('labels_dir', type=str, help="Path to the directory containing YOLO format label files.")
+    parser.add_argument('--workers', type=int, default=0, help="Parser processes (default: one per CPU core).")
+    parser.add_argument('--rebuild', action='store_true', help="Re-parse every label file even if the index is current.")
+    args = parser.parse_args()
+
+    index = load_label_index(args.labels_dir, args.workers, args.rebuild)
+    print(f"{len(index)} label files, {len(index.classes)} boxes, {len(np.unique(index.classes))} classes, "
+          f"index in {index_path(args.labels_dir)}")
+
+if __name__ == "__main__":
+    main()
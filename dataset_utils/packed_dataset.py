@@ -0,0 +1,184 @@
+# packed dataset format: a YOLO images/ + labels/ dataset in a few large shard files
+# Usage: python packed_dataset.py <src_dir> <output_dir> [--shard_size_mb 1024]
+#
+# The encoded images are concatenated unchanged into shard-NNNNN.bin files. index.npy holds the name, shard, byte
+# offset and length of each image and the range of its rows in label_classes.npy / label_boxes.npy, the parsed
+# labels (class and x_center, y_center, width, height). meta.json is written last and marks a complete pack.
+# PackedDataset memory-maps the shards for random access (pack[i], image_bytes, decode_image, labels) or sequential
+# streaming (iter_images). inference.py --input_dir, create_ppe_dataset.py and count_instances.py accept a packed
+# directory wherever they take a loose images/labels directory.
+
+import os
+import json
+import mmap
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+PACK_FORMAT = "ppe-packed"
+PACK_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def is_packed(path):
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f).get('format') == PACK_FORMAT
+
+def _advise(shard, advice):
+    # Read-ahead hint for the kernel where the platform supports it
+    if hasattr(shard, 'madvise') and hasattr(mmap, advice):
+        shard.madvise(getattr(mmap, advice))
+
+class PackedDataset:
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != PACK_FORMAT or self.meta.get('version') != PACK_VERSION:
+            raise ValueError(f"{path} is not a version {PACK_VERSION} packed dataset")
+        self.path = path
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+        self.classes = np.load(os.path.join(path, 'label_classes.npy'), mmap_mode='r')
+        self.boxes = np.load(os.path.join(path, 'label_boxes.npy'), mmap_mode='r')
+        # Image of every label row, the same column LabelIndex has
+        self.image = np.repeat(np.arange(len(self.index), dtype=np.int32), self.index['label_count'])
+        self._shards = [None] * len(self.meta['shards'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        classes, boxes = self.labels(i)
+        return str(self.index['name'][i]), self.image_bytes(i), classes, boxes
+
+    @property
+    def names(self):
+        return self.index['name']
+
+    def _shard(self, number):
+        shard = self._shards[number]
+        if shard is None:
+            with open(os.path.join(self.path, self.meta['shards'][number]), 'rb') as f:
+                shard = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _advise(shard, 'MADV_RANDOM')
+            self._shards[number] = shard
+        return shard
+
+    def image_bytes(self, i):
+        # A zero-copy view into the shard; load_image and cv2.imdecode take it directly
+        entry = self.index[i]
+        offset, length = int(entry['offset']), int(entry['length'])
+        return memoryview(self._shard(int(entry['shard'])))[offset:offset + length]
+
+    def decode_image(self, i):
+        import cv2
+        return cv2.imdecode(np.frombuffer(self.image_bytes(i), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def labels(self, i):
+        start, count = int(self.index['label_start'][i]), int(self.index['label_count'][i])
+        return self.classes[start:start + count], self.boxes[start:start + count]
+
+    def label_rows(self, i):
+        # (n, 5) rows of class, x_center, y_center, width, height, as read from a YOLO .txt file
+        classes, boxes = self.labels(i)
+        return np.column_stack((np.asarray(classes, dtype=np.float64), boxes))
+
+    def iter_images(self, indices=None):
+        # Yields (name, image bytes) in pack order, which is shard order, so reads are sequential
+        for number in range(len(self._shards)):
+            _advise(self._shard(number), 'MADV_SEQUENTIAL')
+        for i in (range(len(self)) if indices is None else indices):
+            yield str(self.index['name'][i]), self.image_bytes(i)
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def pack_dataset(src_dir, output_dir, shard_size_mb=1024, read_threads=8, read_ahead=256):
+    from label_index import load_label_index
+    images_dir = os.path.join(src_dir, 'images')
+    labels_dir = os.path.join(src_dir, 'labels')
+    image_files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    # Label rows of each image, taken from the shared label index in image order
+    label_index = load_label_index(labels_dir) if os.path.isdir(labels_dir) else None
+    rows_of = {}
+    if label_index is not None:
+        counts = label_index.boxes_per_file()
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rows_of = {stem: (start, count) for stem, start, count in zip(label_index.stems(), starts.tolist(), counts.tolist())}
+    label_ranges = [rows_of.get(os.path.splitext(f)[0], (0, 0)) for f in image_files]
+    label_counts = np.array([count for _, count in label_ranges], dtype=np.int64)
+    label_rows = np.concatenate([np.arange(start, start + count, dtype=np.int64) for start, count in label_ranges]
+                                or [np.zeros(0, dtype=np.int64)])
+
+    os.makedirs(output_dir, exist_ok=True)
+    # A previous pack in the same place is invalid from here on
+    if os.path.exists(os.path.join(output_dir, 'meta.json')):
+        os.remove(os.path.join(output_dir, 'meta.json'))
+
+    name_length = max((len(f) for f in image_files), default=1)
+    index = np.zeros(len(image_files), dtype=[('name', f'U{name_length}'), ('shard', '<i4'), ('offset', '<i8'),
+                                              ('length', '<i8'), ('label_start', '<i8'), ('label_count', '<i4')])
+    index['name'] = image_files
+    index['label_count'] = label_counts
+    index['label_start'] = np.concatenate(([0], np.cumsum(label_counts)[:-1])) if len(image_files) else []
+
+    shard_size = shard_size_mb * 1024 * 1024
+    shards = []
+    shard_file = None
+    position = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=read_threads) as executor:
+            # Reads run ahead of the writer by at most read_ahead files
+            for first in range(0, len(image_files), read_ahead):
+                chunk = image_files[first:first + read_ahead]
+                for i, data in enumerate(executor.map(_read_file, [os.path.join(images_dir, f) for f in chunk]), start=first):
+                    if shard_file is None or (position + len(data) > shard_size and position > 0):
+                        if shard_file is not None:
+                            shard_file.close()
+                        shards.append(f"shard-{len(shards):05d}.bin")
+                        shard_file = open(os.path.join(output_dir, shards[-1]), 'wb')
+                        position = 0
+                    shard_file.write(data)
+                    index['shard'][i] = len(shards) - 1
+                    index['offset'][i] = position
+                    index['length'][i] = len(data)
+                    position += len(data)
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    np.save(os.path.join(output_dir, 'index.npy'), index)
+    classes = np.asarray(label_index.classes)[label_rows] if label_index is not None else np.zeros(0, dtype=np.int32)
+    boxes = np.asarray(label_index.boxes)[label_rows] if label_index is not None else np.zeros((0, 4))
+    np.save(os.path.join(output_dir, 'label_classes.npy'), classes.astype(np.int32))
+    np.save(os.path.join(output_dir, 'label_boxes.npy'), boxes.astype(np.float64).reshape(-1, 4))
+    meta = {'format': PACK_FORMAT, 'version': PACK_VERSION, 'shards': shards, 'images': len(image_files),
+            'boxes': int(len(classes)), 'source': os.path.abspath(src_dir)}
+    tmp_path = os.path.join(output_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, 'meta.json'))
+
+    elapsed = time.perf_counter() - start
+    total_mb = int(index['length'].sum()) / (1024 * 1024)
+    print(f"Packed {len(image_files)} images ({total_mb:.0f} MB) and {len(classes)} labels into {len(shards)} shards "
+          f"in {elapsed:.1f}s ({len(image_files) / elapsed if elapsed > 0 else 0.0:.0f} files/sec)")
+    return meta
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a YOLO images/ and labels/ dataset into large shard files.")
+    parser.add_argument('src_dir', type=str, help="Path to the dataset directory containing images/ and labels/.")
+    parser.add_argument('output_dir', type=str, help="Path to the directory to write the packed dataset to.")
+    parser.add_argument('--shard_size_mb', type=int, default=1024, help="Largest size of one shard file.")
+    parser.add_argument('--read_threads', type=int, default=8, help="Threads reading the source images.")
+    args = parser.parse_args()
+
+    pack_dataset(args.src_dir, args.output_dir, args.shard_size_mb, args.read_threads)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
-# script to convert Pascal VOC annotations to YOLO format in place
-# Usage: python pascalVOC_to_yolo.py <input_dir>
+# script to convert Pascal VOC annotations to YOLO format
+# Usage: python pascalVOC_to_yolo.py <input_dir> [--output_dir <output_dir>] [--workers N]
+#
+# XML files are parsed with iterparse across a process pool, each object element freed as soon as it is read.
+# Every .txt is written to a temporary file and renamed into place, so an interrupted run never leaves a
+# half-written label behind. Without --output_dir the conversion is in place as before: the XML is removed only
+# after its .txt is complete. With --output_dir the XML files are kept and a SQLite manifest in the output directory
+# records what was converted, so a rerun only converts new or changed files.
 
 import os
+import sqlite3
+import time
 import xml.etree.ElementTree as ET
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 class_mapping = {
     "person": 0,
@@ -18,55 +27,126 @@ class_mapping = {
     "safety-harness": 9
 }
 
-def convert_pascal_voc_to_yolo(input_dir):
-    for filename in os.listdir(input_dir):
-        if not filename.endswith('.xml'):
-            continue
-
-        xml_path = os.path.join(input_dir, filename)
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-
-        # Get image dimensions
-        size = root.find('size')
-        width = int(size.find('width').text)
-        height = int(size.find('height').text)
-
-        yolo_data = []
-
-        for obj in root.findall('object'):
-            class_name = obj.find('name').text
-            if class_name not in class_mapping:
+def parse_voc(xml_path):
+    # Returns the YOLO lines of one annotation file
+    width = height = None
+    objects = []
+    for _, elem in ET.iterparse(xml_path, events=('end',)):
+        if elem.tag == 'size':
+            width = int(elem.findtext('width'))
+            height = int(elem.findtext('height'))
+        elif elem.tag == 'object':
+            class_name = elem.findtext('name')
+            bbox = elem.find('bndbox')
+            if class_name in class_mapping and bbox is not None:
+                objects.append((class_mapping[class_name],) +
+                               tuple(int(float(bbox.findtext(key))) for key in ('xmin', 'ymin', 'xmax', 'ymax')))
+            elem.clear()
+    if not width or not height:
+        raise ValueError("missing image size")
+
+    yolo_data = []
+    for class_id, xmin, ymin, xmax, ymax in objects:
+        # YOLO format: class_id center_x center_y width height
+        x_center = (xmin + xmax) / 2.0 / width
+        y_center = (ymin + ymax) / 2.0 / height
+        bbox_width = (xmax - xmin) / width
+        bbox_height = (ymax - ymin) / height
+        yolo_data.append(f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
+    return yolo_data
+
+def write_atomic(path, lines):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+def convert_file(xml_path, output_dir, remove_xml):
+    # One process pool task; returns (xml_path, number of objects or None, error)
+    try:
+        yolo_data = parse_voc(xml_path)
+        name = os.path.splitext(os.path.basename(xml_path))[0] + '.txt'
+        write_atomic(os.path.join(output_dir or os.path.dirname(xml_path), name), yolo_data)
+        if remove_xml:
+            os.remove(xml_path)
+        return xml_path, len(yolo_data), None
+    except (ET.ParseError, ValueError, TypeError, OSError) as e:
+        return xml_path, None, str(e)
+
+class Manifest:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS converted ("
+            "xml TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, objects INTEGER NOT NULL, converted_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self.signatures = {name: (size, mtime_ns) for name, size, mtime_ns in
+                           self._db.execute("SELECT xml, size, mtime_ns FROM converted")}
+
+    def mark(self, name, signature, objects):
+        self._db.execute("INSERT OR REPLACE INTO converted (xml, size, mtime_ns, objects, converted_at) VALUES (?, ?, ?, ?, ?)",
+                         (name, signature[0], signature[1], objects, time.time()))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+def convert_pascal_voc_to_yolo(input_dir, output_dir=None, workers=None, manifest_path=None, progress_every=10000):
+    entries = sorted((entry.name, entry.stat()) for entry in os.scandir(input_dir)
+                     if entry.name.endswith('.xml') and entry.is_file())
+    signatures = {name: (stat.st_size, stat.st_mtime_ns) for name, stat in entries}
+
+    manifest = None
+    pending = list(signatures)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        manifest = Manifest(manifest_path or os.path.join(output_dir, 'voc_manifest.sqlite'))
+        # Converted before, unchanged since and its output still there
+        pending = [name for name in pending if manifest.signatures.get(name) != signatures[name] or
+                   not os.path.exists(os.path.join(output_dir, os.path.splitext(name)[0] + '.txt'))]
+        print(f"{len(signatures) - len(pending)} of {len(signatures)} files already converted")
+
+    converted = failed = objects = 0
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = [os.path.join(input_dir, name) for name in pending]
+        results = executor.map(convert_file, paths, [output_dir] * len(paths), [not output_dir] * len(paths),
+                               chunksize=max(1, min(256, len(paths) // (workers * 4))))
+        for xml_path, count, error in results:
+            name = os.path.basename(xml_path)
+            if error is not None:
+                failed += 1
+                print(f"Could not convert {name}: {error}")
                 continue
-
-            class_id = class_mapping[class_name]
-
-            bbox = obj.find('bndbox')
-            xmin = int(bbox.find('xmin').text)
-            ymin = int(bbox.find('ymin').text)
-            xmax = int(bbox.find('xmax').text)
-            ymax = int(bbox.find('ymax').text)
-
-            # YOLO format: class_id center_x center_y width height
-            x_center = (xmin + xmax) / 2.0 / width
-            y_center = (ymin + ymax) / 2.0 / height
-            bbox_width = (xmax - xmin) / width
-            bbox_height = (ymax - ymin) / height
-
-            yolo_data.append(f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
-
-        # Write YOLO data to a new .txt file with the same name as the XML file
-        output_file = os.path.join(input_dir, filename.replace('.xml', '.txt'))
-        with open(output_file, 'w') as f:
-            f.writelines(yolo_data)
-
-        # Remove the original XML file
-        os.remove(xml_path)
+            converted += 1
+            objects += count
+            if manifest is not None:
+                manifest.mark(name, signatures[name], count)
+            if converted % progress_every == 0:
+                if manifest is not None:
+                    manifest.commit()
+                elapsed = time.perf_counter() - start
+                print(f"Converted {converted}/{len(pending)} files ({converted / elapsed:.0f} files/sec)")
+    if manifest is not None:
+        manifest.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Converted {converted} files with {objects} objects in {elapsed:.1f}s "
+          f"({converted / elapsed if elapsed > 0 else 0.0:.0f} files/sec), {failed} failed")
+    return converted, failed
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Convert Pascal VOC annotations to YOLO format in place.")
+    parser = argparse.ArgumentParser(description="Convert Pascal VOC annotations to YOLO format.")
     parser.add_argument('input_dir', type=str, help="Path to the directory containing Pascal VOC XML files.")
+    parser.add_argument('--output_dir', type=str, help="Write the .txt files here and keep the XML files (default: in place, removing the XML).")
+    parser.add_argument('--workers', type=int, default=0, help="Parser processes (default: one per CPU core).")
+    parser.add_argument('--manifest', type=str, help="Manifest of converted files (default: <output_dir>/voc_manifest.sqlite).")
 
     args = parser.parse_args()
 
-    convert_pascal_voc_to_yolo(args.input_dir)
+    convert_pascal_voc_to_yolo(args.input_dir, args.output_dir, args.workers, args.manifest)
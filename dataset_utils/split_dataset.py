@@ -1,72 +1,190 @@
 # script to filter out labels except person label and split a dataset into train, validation, and test sets
-# Usage: python split_dataset.py <src_dir> <dest_dir> [--split_ratios SPLIT_RATIOS]
+# Usage: python split_dataset.py <src_dir> <dest_dir> [--split_ratios SPLIT_RATIOS] [--mode hardlink|symlink|copy|manifest] [--seed N]
+#
+# The split is stratified by class presence: each image is grouped by the rarest class in its labels and every group
+# is divided by the split ratios, so rare classes end up in all splits. The same seed always gives the same split.
+# Images are hardlinked into the splits by default (copied in parallel only when src and dest are on different
+# filesystems), or symlinked, or copied. --mode manifest keeps one dest_dir/images (hardlinked, copied across
+# filesystems) next to the filtered dest_dir/labels and writes train.txt/valid.txt/test.txt listing those images,
+# which a YOLO data.yaml can point to directly.
 
-import os, shutil, random, argparse, sys
+import os, shutil, argparse, sys, errno
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
+from label_index import load_label_index
 
-def filter_labels_and_copy(src_dir, dest_dir, split_ratios=(0.8, 0.1, 0.1)):
+SPLITS = ['train', 'valid', 'test']
+MODES = ['hardlink', 'symlink', 'copy', 'manifest']
+UNLABELLED = -1
+NO_BOXES = -2
+
+def image_strata(image_files, index):
+    # Stratum of each image: its rarest class, or UNLABELLED / NO_BOXES
+    strata = np.full(len(image_files), UNLABELLED, dtype=np.int64)
+    if index is None or not len(index):
+        return strata
+    file_indices = {stem: i for i, stem in enumerate(index.stems())}
+    rows = np.array([file_indices.get(os.path.splitext(f)[0], -1) for f in image_files], dtype=np.int64)
+
+    class_ids, classes = np.unique(index.classes, return_inverse=True)
+    presence = np.zeros((len(index), len(class_ids)), dtype=bool)
+    presence[index.image, classes] = True
+    # Images per class; absent classes count as infinitely common so argmin picks the rarest present class
+    frequency = np.where(presence, presence.sum(axis=0), np.iinfo(np.int64).max)
+    rarest = class_ids[frequency.argmin(axis=1)] if len(class_ids) else np.zeros(len(index), dtype=np.int64)
+    file_strata = np.where(presence.any(axis=1), rarest, NO_BOXES)
+
+    labelled = rows >= 0
+    strata[labelled] = file_strata[rows[labelled]]
+    return strata
+
+def split_counts(n, debt, ratios):
+    # Divide n images by the ratios, carrying the rounding left over from earlier strata in debt
+    debt += n * ratios
+    counts = np.maximum(np.floor(debt), 0).astype(int)
+    while counts.sum() < n:
+        counts[np.argmax(debt - counts)] += 1
+    while counts.sum() > n:
+        counts[np.argmin(np.where(counts > 0, debt - counts, np.inf))] -= 1
+    debt -= counts
+    return counts
+
+def assign_splits(image_files, strata, split_ratios, seed=0):
+    ratios = np.asarray(split_ratios, dtype=np.float64)
+    ratios = ratios / ratios.sum()
+    rng = np.random.default_rng(seed)
+    debt = np.zeros(len(ratios))
+    splits = [[] for _ in ratios]
+    for stratum in np.unique(strata):
+        members = [image_files[i] for i in rng.permutation(np.flatnonzero(strata == stratum))]
+        start = 0
+        for split_files, count in zip(splits, split_counts(len(members), debt, ratios)):
+            split_files.extend(members[start:start + count])
+            start += count
+    return [sorted(split_files) for split_files in splits]
+
+def _replace(dest_path):
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+
+def link_images(pairs, mode, copy_workers=8):
+    # Returns how many images were copied instead of linked
+    to_copy = []
+    for src_path, dest_path in pairs:
+        _replace(dest_path)
+        if mode == 'copy':
+            to_copy.append((src_path, dest_path))
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src_path), dest_path)
+        else:
+            try:
+                os.link(src_path, dest_path)
+            except OSError as e:
+                # Hardlinks cannot cross filesystems (or are unsupported there); copy those instead
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK):
+                    raise
+                to_copy.append((src_path, dest_path))
+    with ThreadPoolExecutor(max_workers=copy_workers) as executor:
+        list(executor.map(lambda pair: shutil.copyfile(*pair), to_copy))
+    return len(to_copy)
+
+def write_manifest(path, image_paths):
+    with open(path, 'w') as f:
+        f.writelines(os.path.abspath(image_path) + '\n' for image_path in image_paths)
+
+def write_filtered_labels(files, index, file_indices, persons, labels_dir):
+    # Person-only label file of every image, empty when it has no labels
+    labelled = []
+    for image_file in files:
+        stem = os.path.splitext(image_file)[0]
+        if stem in file_indices:
+            labelled.append(file_indices[stem])
+        else:
+            # Create an empty label file if the label doesn't exist
+            open(os.path.join(labels_dir, stem + '.txt'), 'w').close()
+
+    # Write the filtered or empty label files
+    if labelled:
+        index.write_labels(persons, labels_dir, write_empty=True, files=labelled)
+
+def filter_labels_and_copy(src_dir, dest_dir, split_ratios=(0.8, 0.1, 0.1), mode='hardlink', seed=0, stratify=True,
+                           copy_workers=8):
     images_dir = os.path.join(src_dir, 'images')
     labels_dir = os.path.join(src_dir, 'labels')
-    
+
+    # Get all image files, sorted so the split only depends on the seed
+    image_files = sorted(f for f in os.listdir(images_dir) if f.endswith(('.png', '.jpg', '.jpeg')))
+
+    index = load_label_index(labels_dir) if os.path.isdir(labels_dir) else None
+    strata = image_strata(image_files, index) if stratify else np.zeros(len(image_files), dtype=np.int64)
+    split_files = assign_splits(image_files, strata, split_ratios, seed)
+    for split, files in zip(SPLITS, split_files):
+        print(f"{split}: {len(files)} images")
+
+    Path(dest_dir).mkdir(parents=True, exist_ok=True)
+    file_indices = {stem: i for i, stem in enumerate(index.stems())} if index is not None else {}
+    # Filter for class_id 0
+    persons = index.classes == 0 if index is not None else None
+
+    if mode == 'manifest':
+        # YOLO finds the labels of an image in the labels/ next to its images/, so the lists must name images that
+        # sit beside the filtered labels rather than the source images with their unfiltered labels
+        dest_images_dir = os.path.join(dest_dir, 'images')
+        dest_labels_dir = os.path.join(dest_dir, 'labels')
+        Path(dest_images_dir).mkdir(parents=True, exist_ok=True)
+        Path(dest_labels_dir).mkdir(parents=True, exist_ok=True)
+        all_files = sorted(f for files in split_files for f in files)
+        copied = link_images([(os.path.join(images_dir, f), os.path.join(dest_images_dir, f)) for f in all_files],
+                             'hardlink', copy_workers)
+        write_filtered_labels(all_files, index, file_indices, persons, dest_labels_dir)
+        for split, files in zip(SPLITS, split_files):
+            write_manifest(os.path.join(dest_dir, f"{split}.txt"), [os.path.join(dest_images_dir, f) for f in files])
+        if copied:
+            print(f"Copied {copied} images that could not be hardlinked")
+        return split_files
+
     # Ensure destination directory structure
-    for split in ['train', 'valid', 'test']:
+    for split in SPLITS:
         Path(os.path.join(dest_dir, split, 'images')).mkdir(parents=True, exist_ok=True)
         Path(os.path.join(dest_dir, split, 'labels')).mkdir(parents=True, exist_ok=True)
 
-    # Get all image files
-    image_files = [f for f in os.listdir(images_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    
-    # Shuffle the images for random splitting
-    random.shuffle(image_files)
-    
-    # Calculate split indices
-    total_images = len(image_files)
-    train_end = int(total_images * split_ratios[0])
-    valid_end = train_end + int(total_images * split_ratios[1])
-    
-    train_files = image_files[:train_end]
-    valid_files = image_files[train_end:valid_end]
-    test_files = image_files[valid_end:]
-    
-    # Process each split
-    for split, split_files in zip(['train', 'valid', 'test'], [train_files, valid_files, test_files]):
-        for image_file in split_files:
-            # Copy the image file
-            src_image_path = os.path.join(images_dir, image_file)
-            dest_image_path = os.path.join(dest_dir, split, 'images', image_file)
-            shutil.copyfile(src_image_path, dest_image_path)
-            
-            # Process the corresponding label file
-            label_file = os.path.splitext(image_file)[0] + '.txt'
-            src_label_path = os.path.join(labels_dir, label_file)
-            dest_label_path = os.path.join(dest_dir, split, 'labels', label_file)
-            
-            if os.path.exists(src_label_path):
-                with open(src_label_path, 'r') as f:
-                    lines = f.readlines()
-                
-                # Filter for class_id 0
-                filtered_lines = [line for line in lines if line.startswith('0')]
-                
-                # Write the filtered or empty label file
-                with open(dest_label_path, 'w') as f:
-                    f.writelines(filtered_lines)
-            else:
-                # Create an empty label file if the label doesn't exist
-                open(dest_label_path, 'w').close()
+    copied = 0
+    for split, files in zip(SPLITS, split_files):
+        split_images_dir = os.path.join(dest_dir, split, 'images')
+        split_labels_dir = os.path.join(dest_dir, split, 'labels')
+        copied += link_images([(os.path.join(images_dir, f), os.path.join(split_images_dir, f)) for f in files],
+                              mode, copy_workers)
+
+        write_filtered_labels(files, index, file_indices, persons, split_labels_dir)
+        # A record of the split that also works as a YOLO image list
+        write_manifest(os.path.join(dest_dir, f"{split}.txt"), [os.path.join(split_images_dir, f) for f in files])
+
+    if mode == 'hardlink' and copied:
+        print(f"Copied {copied} images that could not be hardlinked")
+    return split_files
 
 def main():
     parser = argparse.ArgumentParser(description="Filter person labels from YOLO format label files and split the dataset.")
     parser.add_argument('src_dir', type=str, help="Path to the source dataset directory.")
     parser.add_argument('dest_dir', type=str, help="Path to the destination directory to save the filtered dataset.")
     parser.add_argument('--split_ratios', nargs='+', type=float, default=[0.8, 0.1, 0.1], help="Train, validation, and test split ratios.")
+    parser.add_argument('--mode', choices=MODES, default='hardlink', help="How images are placed in the splits (default: hardlink, copying across filesystems); manifest links them "
+                             "once into dest_dir/images beside the filtered dest_dir/labels and lists them in train/valid/test.txt.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the shuffle; the same seed gives the same split.")
+    parser.add_argument('--no_stratify', dest='stratify', action='store_false', help="Plain seeded shuffle instead of stratifying by class presence.")
+    parser.add_argument('--copy_workers', type=int, default=8, help="Threads for the images that have to be copied.")
     args = parser.parse_args()
     if not args.src_dir or not args.dest_dir:
         print("Error: Both src_dir and dest_dir arguments are required.")
         print("Usage: python script_name.py <src_dir> <dest_dir> [--split_ratios SPLIT_RATIOS]")
         sys.exit(1)
-    
-    filter_labels_and_copy(args.src_dir, args.dest_dir, args.split_ratios)
+    if len(args.split_ratios) != len(SPLITS):
+        print("Error: --split_ratios needs a train, validation and test ratio.")
+        sys.exit(1)
+
+    filter_labels_and_copy(args.src_dir, args.dest_dir, args.split_ratios, args.mode, args.seed, args.stratify,
+                           args.copy_workers)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+# Inference engines behind load_models / detect_persons / detect_ppe_ensemble
+# Every engine is called with a list of BGR images and returns one Detections per image,
+# with boxes in the coordinates of the image that was passed in.
+
+import argparse
+import os
+import sys
+from collections import namedtuple
+import cv2
+import numpy as np
+from fusion import box_iou, nms
+
+Detections = namedtuple("Detections", ["boxes", "scores", "classes"])
+
+BACKENDS = ("torch", "onnx", "int8")
+
+def letterbox(image, size=640, color=(114, 114, 114)):
+    # Resize keeping the aspect ratio and pad to a size x size square
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width = max(1, int(round(width * scale)))
+    new_height = max(1, int(round(height * scale)))
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_x = (size - new_width) // 2
+    pad_y = (size - new_height) // 2
+    canvas = np.full((size, size, 3), color, dtype=image.dtype)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+    return canvas, scale, (pad_x, pad_y)
+
+class TorchEngine:
+    # ultralytics YOLO in PyTorch eager mode, the original behaviour
+    def __init__(self, weights_path):
+        from ultralytics import YOLO
+        self.weights_path = weights_path
+        self.model = YOLO(weights_path)
+
+    def __call__(self, images, imgsz=640):
+        detections = []
+        for result in self.model(images, imgsz=imgsz):
+            detections.append(Detections(
+                result.boxes.xyxy.cpu().numpy(),
+                result.boxes.conf.cpu().numpy(),
+                result.boxes.cls.cpu().numpy(),
+            ))
+        return detections
+
+class OnnxEngine:
+    # YOLOv8 graph exported to ONNX and run with ONNX Runtime; pre- and postprocessing in NumPy.
+    # Thresholds match the ultralytics predict defaults so results line up with TorchEngine.
+    def __init__(self, onnx_path, conf_threshold=0.25, iou_threshold=0.7, max_detections=300, num_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.weights_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+
+    @staticmethod
+    def preprocess(images, imgsz):
+        batch = np.empty((len(images), 3, imgsz, imgsz), dtype=np.float32)
+        transforms = []
+        for i, image in enumerate(images):
+            canvas, scale, pad = letterbox(image, imgsz)
+            # BGR HWC uint8 -> RGB CHW float in [0, 1]
+            batch[i] = canvas[:, :, ::-1].transpose(2, 0, 1) / 255.0
+            transforms.append((scale, pad, image.shape[:2]))
+        return batch, transforms
+
+    def postprocess(self, output, transform):
+        # output is (4 + num_classes, num_anchors) with boxes as centre x, centre y, width, height
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        mask = scores > self.conf_threshold
+        if not mask.any():
+            return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32))
+
+        xywh, scores, classes = predictions[mask, :4], scores[mask], classes[mask]
+        boxes = np.concatenate((xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2), axis=1)
+        boxes, scores, classes = nms(np.column_stack((boxes, scores, classes)), self.iou_threshold, score_threshold=0.0)
+        boxes, scores, classes = boxes[:self.max_detections], scores[:self.max_detections], classes[:self.max_detections]
+
+        # Undo the letterbox
+        scale, (pad_x, pad_y), (height, width) = transform
+        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad_x) / scale, 0, width)
+        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad_y) / scale, 0, height)
+        return Detections(boxes.astype(np.float32), scores.astype(np.float32), classes.astype(np.float32))
+
+    def __call__(self, images, imgsz=640):
+        batch, transforms = self.preprocess(images, imgsz)
+        outputs = self.session.run(None, {self.input_name: batch})[0]
+        return [self.postprocess(output, transform) for output, transform in zip(outputs, transforms)]
+
+def export_onnx(weights_path, imgsz=640):
+    # Export once and cache the .onnx next to the .pt, re-exporting only when the weights are newer
+    onnx_path = os.path.splitext(weights_path)[0] + ".onnx"
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(weights_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+    exported_path = YOLO(weights_path).export(format="onnx", imgsz=imgsz, dynamic=True)
+    if os.path.abspath(exported_path) != os.path.abspath(onnx_path):
+        os.replace(exported_path, onnx_path)
+    return onnx_path
+
+def int8_path(weights_path):
+    # INT8 artifacts produced by quantize.py sit next to the .pt like the fp32 .onnx
+    return os.path.splitext(weights_path)[0] + ".int8.onnx"
+
+def load_engine(weights_path, backend="torch"):
+    if backend == "torch":
+        return TorchEngine(weights_path)
+    if backend == "onnx":
+        return OnnxEngine(export_onnx(weights_path))
+    if backend == "int8":
+        quantized_path = int8_path(weights_path)
+        if not os.path.exists(quantized_path):
+            raise FileNotFoundError(f"{quantized_path} not found, create it with quantize.py")
+        return OnnxEngine(quantized_path)
+    raise ValueError(f"Unknown backend: {backend}")
+
+def match_rate(reference, candidate, iou_threshold=0.5, score_tolerance=0.05):
+    # Fraction of reference boxes with a same-class candidate box above the IoU threshold
+    # and a score within the tolerance; 1.0 when both engines agree completely.
+    if len(reference.boxes) == 0:
+        return 1.0 if len(candidate.boxes) == 0 else 0.0
+    if len(candidate.boxes) == 0:
+        return 0.0
+    ious = box_iou(np.asarray(reference.boxes, np.float64), np.asarray(candidate.boxes, np.float64))
+    same_class = reference.classes[:, None] == candidate.classes[None, :]
+    close_score = np.abs(reference.scores[:, None] - candidate.scores[None, :]) <= score_tolerance
+    matched = ((ious >= iou_threshold) & same_class & close_score).any(axis=1)
+    return float(matched.mean())
+
+def compare_engines(reference, candidate, images, imgsz=640, iou_threshold=0.5, score_tolerance=0.05):
+    # Average match rate of candidate against reference over a list of images
+    rates = []
+    for image in images:
+        rates.append(match_rate(reference([image], imgsz)[0], candidate([image], imgsz)[0], iou_threshold, score_tolerance))
+    return float(np.mean(rates)) if rates else 1.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a YOLO checkpoint to ONNX and check it against the PyTorch results.")
+    parser.add_argument('weights', type=str, help="Path to a .pt checkpoint (person.pt or a ppe_fold_*.pt).")
+    parser.add_argument('images_dir', type=str, help="Directory with sample images to compare on.")
+    parser.add_argument('--imgsz', type=int, default=640, help="Inference size.")
+    parser.add_argument('--min_match', type=float, default=0.95, help="Fail when fewer boxes than this agree.")
+    args = parser.parse_args()
+
+    images = [cv2.imread(os.path.join(args.images_dir, f)) for f in sorted(os.listdir(args.images_dir))
+              if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    rate = compare_engines(load_engine(args.weights, "torch"), load_engine(args.weights, "onnx"), images, args.imgsz)
+    print(f"ONNX matches PyTorch on {rate * 100:.1f}% of boxes over {len(images)} images")
+    if rate < args.min_match:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Vectorized box fusion for the PPE fold ensemble
+# Predictions are (N, 6) arrays laid out as x1, y1, x2, y2, score, class
+import numpy as np
+
+def box_iou(boxes1, boxes2):
+    # Pairwise IoU matrix of shape (len(boxes1), len(boxes2))
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:4], boxes2[None, :, 2:4])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    intersection = wh[..., 0] * wh[..., 1]
+
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def paired_iou(boxes1, boxes2):
+    # Element-wise IoU between two equally sized arrays of boxes
+    width = np.minimum(boxes1[:, 2], boxes2[:, 2]) - np.maximum(boxes1[:, 0], boxes2[:, 0])
+    height = np.minimum(boxes1[:, 3], boxes2[:, 3]) - np.maximum(boxes1[:, 1], boxes2[:, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union = area1 + area2 - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def _sort_by_score(predictions):
+    indices = np.argsort(predictions[:, 4])[::-1]
+    return predictions[indices]
+
+def _suppression_pairs(predictions, iou_threshold, class_agnostic):
+    # Returns index arrays (i, j), i < j, of score-sorted boxes where box i can suppress box j.
+    # Only pairs that overlap along x are scored, found with a sort and searchsorted sweep.
+    boxes = predictions[:, :4].astype(np.float64)
+    if not class_agnostic:
+        # Shift each class into its own band along x so different classes never overlap
+        band = boxes[:, 2].max() - boxes[:, 0].min() + 1
+        boxes[:, [0, 2]] += (predictions[:, 5] * band)[:, None]
+
+    count = len(boxes)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    sorted_x1 = boxes[order, 0]
+    ends = np.searchsorted(sorted_x1, boxes[order, 2], side="left")
+    run_lengths = np.maximum(ends - np.arange(1, count + 1), 0)
+
+    first = np.repeat(np.arange(count), run_lengths)
+    run_starts = np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+    second = first + 1 + np.arange(len(first)) - run_starts
+    first, second = order[first], order[second]
+
+    overlapping = paired_iou(boxes[first], boxes[second]) >= iou_threshold
+    first, second = first[overlapping], second[overlapping]
+    return np.minimum(first, second), np.maximum(first, second)
+
+def _greedy_keep(count, suppressor, suppressed):
+    # Cluster-NMS: iterate the suppression pairs to the same fixed point as greedy NMS.
+    # Each pass settles at least one more box, usually converging in a handful of passes.
+    keep = np.ones(count, dtype=bool)
+    for _ in range(count):
+        new_keep = np.ones(count, dtype=bool)
+        new_keep[suppressed[keep[suppressor]]] = False
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    return keep
+
+def _empty_result():
+    return np.zeros((0, 4)), np.zeros(0), np.zeros(0)
+
+def nms(predictions, iou_threshold=0.5, score_threshold=0.5, class_agnostic=False):
+    if len(predictions) == 0:
+        return _empty_result()
+
+    predictions = _sort_by_score(predictions)
+    suppressor, suppressed = _suppression_pairs(predictions, iou_threshold, class_agnostic)
+    keep = _greedy_keep(len(predictions), suppressor, suppressed)
+    kept = predictions[keep]
+
+    # Filter by score threshold after suppression, like the original implementation
+    kept = kept[kept[:, 4] >= score_threshold]
+    return kept[:, :4], kept[:, 4], kept[:, 5]
+
+def weighted_boxes_fusion(predictions, num_models, iou_threshold=0.55, score_threshold=0.5):
+    # Merge the fold outputs instead of discarding overlaps: each cluster is led by the box NMS
+    # would keep and every suppressed box joins the highest scored leader that suppressed it.
+    if len(predictions) == 0:
+        return _empty_result()
+
+    predictions = _sort_by_score(predictions)
+    count = len(predictions)
+    suppressor, suppressed = _suppression_pairs(predictions, iou_threshold, class_agnostic=False)
+    keep = _greedy_keep(count, suppressor, suppressed)
+
+    # Boxes are sorted by score, so the lowest suppressing index is the best scored leader
+    leaders = np.arange(count)
+    by_leader = keep[suppressor]
+    np.minimum.at(leaders, suppressed[by_leader], suppressor[by_leader])
+    _, cluster = np.unique(leaders, return_inverse=True)
+    num_clusters = cluster.max() + 1
+
+    scores = predictions[:, 4]
+    weight_sum = np.bincount(cluster, weights=scores, minlength=num_clusters)
+    members = np.bincount(cluster, minlength=num_clusters)
+    fused_boxes = np.stack([
+        np.bincount(cluster, weights=scores * predictions[:, i], minlength=num_clusters)
+        for i in range(4)
+    ], axis=1) / weight_sum[:, None]
+
+    # Average confidence, down-weighted when fewer folds than the ensemble size agree
+    fused_scores = weight_sum / members * np.minimum(members, num_models) / num_models
+    fused_classes = predictions[np.flatnonzero(keep), 5]
+
+    order = np.argsort(fused_scores)[::-1]
+    order = order[fused_scores[order] >= score_threshold]
+    return fused_boxes[order], fused_scores[order], fused_classes[order]
+
+def fuse_predictions(predictions, method="nms", num_models=1, iou_threshold=0.5, score_threshold=0.5):
+    if method == "nms":
+        return nms(predictions, iou_threshold, score_threshold)
+    if method == "wbf":
+        return weighted_boxes_fusion(predictions, num_models, iou_threshold, score_threshold)
+    raise ValueError(f"Unknown fusion method: {method}")
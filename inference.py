@@ -1,37 +1,158 @@
 import argparse
 import os
+import struct
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+import metrics
+from cascade import FoldCascade, cascade_summary
+from crop_planner import CropPlanner
+from engines import BACKENDS, letterbox, load_engine
+from fusion import fuse_predictions, nms
+from results_io import RESULT_FORMATS, ResultWriter, make_record, record_ppe_results
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+TUNE_CONFIG_NAME = "autotune.json"
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Object detection for persons and PPE")
-    parser.add_argument("--input_dir", required=True, help="Input directory containing images")
+    parser.add_argument("--input_dir", help="Input directory containing images, or a packed dataset")
     parser.add_argument("--output_dir", required=True, help="Output directory to save results")
     parser.add_argument("--person_model", required=True, help="Path to the person detection model")
     parser.add_argument("--ppe_models_dir", required=True, help="Directory containing PPE detection models")
-    return parser.parse_args()
+    parser.add_argument("--ppe_soup", help="Weight-averaged PPE checkpoint from model_soup.py to run instead of the folds")
+    parser.add_argument("--fusion", choices=["nms", "wbf"], default="nms", help="How to merge the PPE fold predictions")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference engine: ultralytics/PyTorch or ONNX Runtime")
+    parser.add_argument("--pipeline", action="store_true", help="Overlap decoding, inference and writing with bounded queues")
+    parser.add_argument("--batch_size", type=int, default=8, help="Images per inference batch in pipeline mode")
+    parser.add_argument("--decode_workers", type=int, default=4, help="Decoding threads in pipeline mode")
+    parser.add_argument("--write_workers", type=int, default=2, help="Drawing and encoding threads in pipeline mode")
+    parser.add_argument("--queue_size", type=int, default=32, help="Maximum images buffered between pipeline stages")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to shard the input directory across")
+    parser.add_argument("--threads_per_worker", type=int, default=0, help="Torch/OpenCV threads per worker (default: cores / workers)")
+    parser.add_argument("--torch_threads", type=int, default=0, help="Torch intra-op threads of a single-process run (default: torch's own)")
+    parser.add_argument("--cv2_threads", type=int, default=0, help="OpenCV threads of a single-process run (default: OpenCV's own)")
+    parser.add_argument("--ppe_batch_size", type=int, default=32, help="Person crops per PPE model call")
+    parser.add_argument("--autotune", action="store_true", help="Benchmark thread counts, PPE batch size and workers on --input_dir and save the fastest setting")
+    parser.add_argument("--tune_config", help="Tuned settings file, loaded automatically when present (default: <ppe_models_dir>/autotune.json)")
+    parser.add_argument("--tune_images", type=int, default=8, help="Autotune: sample images per measured setting")
+    parser.add_argument("--use_tuned_workers", action="store_true", help="Also take --workers and --threads_per_worker from the tuned settings file")
+    parser.add_argument("--tune_memory_mb", type=int, default=0, help="Autotune: peak memory budget across all workers (default: 75%% of RAM)")
+    parser.add_argument("--results", help="Write per-image detection records to this .jsonl or .parquet file")
+    parser.add_argument("--results_format", choices=RESULT_FORMATS, help="Results file format (default: from the file extension)")
+    parser.add_argument("--no-render", dest="render", action="store_false", help="Skip drawing and encoding annotated images")
+    parser.add_argument("--cache_dir", help="Directory of a persistent result cache; unchanged images are not re-processed")
+    parser.add_argument("--cache_max_mb", type=int, default=1024, help="Size bound of the result cache, least recently used entries are evicted")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process images as they land in --input_dir")
+    parser.add_argument("--manifest", help="Watch mode manifest of processed files (default: <output_dir>/watch_manifest.sqlite)")
+    parser.add_argument("--settle_seconds", type=float, default=2.0, help="Watch mode: a file is read once its size and mtime are unchanged this long")
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="Watch mode: seconds between directory scans when inotify is unavailable")
+    parser.add_argument("--video", help="Video file, RTSP/HTTP stream URL or camera index to process instead of --input_dir")
+    parser.add_argument("--detect_every", type=int, default=1, help="Run person detection every N frames in video mode, tracking in between")
+    parser.add_argument("--ppe_refresh", type=int, default=30, help="Re-run the PPE ensemble on a tracked person at least every N frames")
+    parser.add_argument("--ppe_change_iou", type=float, default=0.7, help="Re-run the PPE ensemble when a tracked box overlaps its last PPE box less than this")
+    parser.add_argument("--person_imgsz", type=int, default=0, help="Detect persons on a reduced-resolution decode with this input size; full resolution is decoded only for the crops")
+    parser.add_argument("--merge_crops", action="store_true", help="Merge overlapping person crops into shared regions and drop tiny crops before the PPE ensemble")
+    parser.add_argument("--min_crop_size", type=int, default=16, help="With --merge_crops, person boxes narrower or shorter than this are not sent to the PPE models")
+    parser.add_argument("--max_region_size", type=int, default=640, help="With --merge_crops, the largest side of a merged region")
+    parser.add_argument("--merge_overlap", type=float, default=0.3, help="With --merge_crops, the share of a person box that must overlap a region to join it")
+    parser.add_argument("--cascade", action="store_true", help="Run the PPE folds as an early-exit cascade instead of always running every fold")
+    parser.add_argument("--cascade_order", help="Comma-separated fold indices (ppe_fold_* files in name order) giving the cascade order")
+    parser.add_argument("--cascade_min_folds", type=int, default=2, help="Folds that must agree on a crop before the remaining folds are skipped")
+    parser.add_argument("--cascade_iou", type=float, default=0.5, help="IoU for two folds' boxes to count as agreeing")
+    parser.add_argument("--cascade_score_tolerance", type=float, default=0.1, help="Largest score difference for two folds' boxes to count as agreeing")
+    parser.add_argument("--cascade_audit", type=float, default=0.05, help="Fraction of early exits also run through the full ensemble to measure agreement")
+    parser.add_argument("--metrics", help="Write Prometheus-format metrics (stage latencies, persons, crops, fold calls) to this file at the end")
+    parser.add_argument("--metrics_port", type=int, help="Serve live Prometheus-format metrics on http://<host>:<port>/metrics")
+    parser.add_argument("--profile_slowest", type=int, default=0, help="Keep cProfile dumps of the N slowest sampled images")
+    parser.add_argument("--profile_sample", type=float, default=0.1, help="Fraction of images profiled for --profile_slowest")
+    parser.add_argument("--profile_dir", help="Directory for the .prof files (default: <output_dir>/profiles)")
+    args = parser.parse_args()
+    if not args.autotune:
+        # Settings from an earlier --autotune run fill in whatever was not given on the command line
+        from autotune import SHARDING_SETTINGS, TUNED_SETTINGS, load_tuned_config
+        # A tuned worker count is only applied on request; watch and video runs are always one process
+        sharded = args.use_tuned_workers and not (args.watch or args.video)
+        keys = TUNED_SETTINGS if sharded else tuple(key for key in TUNED_SETTINGS if key not in SHARDING_SETTINGS)
+        tuned = load_tuned_config(tune_config_path(args), args.backend, keys)
+        if tuned:
+            parser.set_defaults(**tuned)
+            args = parser.parse_args()
+            if sharded and args.workers > 1 and args.workers == tuned.get('workers'):
+                print(f"Sharding across {args.workers} workers as tuned in {tune_config_path(args)}")
+    if not args.input_dir and not args.video:
+        parser.error("one of --input_dir or --video is required")
+    if args.watch and (args.pipeline or args.video or args.workers > 1 or not args.input_dir):
+        parser.error("--watch needs --input_dir and cannot be combined with --pipeline, --video or --workers")
+    if args.watch and args.results and not args.results.endswith(".jsonl") and args.results_format != "jsonl":
+        parser.error("--watch appends to the results file, which needs the jsonl format")
+    if args.person_imgsz and (args.pipeline or args.video):
+        parser.error("--person_imgsz works on encoded images one at a time and cannot be combined with --pipeline or --video")
+    if args.autotune and not args.input_dir:
+        parser.error("--autotune needs --input_dir to sample images from")
+    if args.profile_slowest and args.pipeline:
+        parser.error("--profile_slowest profiles one image at a time and cannot be combined with --pipeline")
+    if args.detect_every < 1:
+        parser.error("--detect_every must be at least 1")
+    if args.video and (args.results or not args.render or args.cache_dir or args.merge_crops):
+        parser.error("--results, --no-render, --cache_dir and --merge_crops do not apply to --video")
+    if args.watch and open_packed_input(args.input_dir) is not None:
+        parser.error("--watch needs a folder of image files, not a packed dataset")
+    return args
+
+def open_packed_input(input_dir):
+    # A packed dataset (dataset_utils/packed_dataset.py) is read from its shards instead of listed; None otherwise
+    from dataset_utils.packed_dataset import PackedDataset, is_packed
+    return PackedDataset(input_dir) if input_dir and is_packed(input_dir) else None
+
+def tune_config_path(args):
+    return args.tune_config or os.path.join(args.ppe_models_dir, TUNE_CONFIG_NAME)
 
-def load_models(person_model_path, ppe_models_dir):
-    person_model = YOLO(person_model_path)
-    ppe_models = []
-    for file in os.listdir(ppe_models_dir):
+def configure_threads(torch_threads=0, cv2_threads=0):
+    # 0 leaves the library default alone
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    if cv2_threads:
+        cv2.setNumThreads(cv2_threads)
+
+def list_ppe_model_paths(ppe_models_dir):
+    model_paths = []
+    # Sorted so fold indices (e.g. in --cascade_order) are stable across machines
+    for file in sorted(os.listdir(ppe_models_dir)):
         if file.startswith("ppe_fold_") and file.endswith(".pt"):
-            model_path = os.path.join(ppe_models_dir, file)
-            ppe_models.append(YOLO(model_path))
+            model_paths.append(os.path.join(ppe_models_dir, file))
+    return model_paths
+
+def load_models(person_model_path, ppe_models_dir, backend="torch", ppe_soup=None):
+    person_model = load_engine(person_model_path, backend)
+    if ppe_soup:
+        # One weight-averaged model (model_soup.py) instead of every fold
+        return person_model, [load_engine(ppe_soup, backend)]
+    ppe_models = [load_engine(model_path, backend) for model_path in list_ppe_model_paths(ppe_models_dir)]
     return person_model, ppe_models
 
-def detect_persons(image, model):
-    results = model(image)[0]
-    return results.boxes.xyxy.cpu().numpy(), results.boxes.conf.cpu().numpy()
+def detect_persons(image, model, imgsz=640):
+    results = model([image], imgsz=imgsz)[0]
+    if metrics.active is not None:
+        metrics.active.observe('ppe_persons_per_image', len(results.boxes))
+    return results.boxes, results.scores
 
-def detect_ppe_ensemble(cropped_image, models):
+def detect_persons_batch(images, model, imgsz=640):
+    results = model(images, imgsz=imgsz)
+    if metrics.active is not None:
+        for r in results:
+            metrics.active.observe('ppe_persons_per_image', len(r.boxes))
+    return [(r.boxes, r.scores) for r in results]
+
+def detect_ppe_ensemble(cropped_image, models, fusion="nms"):
+    collector = metrics.active
     all_predictions = []
-    for model in models:
-        results = model(cropped_image)[0]
-        boxes = results.boxes.xyxy.cpu().numpy()
-        scores = results.boxes.conf.cpu().numpy()
-        classes = results.boxes.cls.cpu().numpy()
+    for fold, model in enumerate(models):
+        boxes, scores, classes = model([cropped_image])[0]
+        if collector is not None:
+            collector.inc('ppe_fold_calls_total', fold=fold)
+            collector.inc('ppe_fold_images_total', fold=fold)
         if len(boxes) > 0:
             all_predictions.append(np.column_stack((boxes, scores, classes)))
     
@@ -40,42 +161,161 @@ def detect_ppe_ensemble(cropped_image, models):
     
     # Combine predictions from all models
     all_predictions = np.vstack(all_predictions)
+    if collector is not None:
+        collector.observe('ppe_nms_input_boxes', len(all_predictions))
     
-    # Perform non-maximum suppression
-    final_boxes, final_scores, final_classes = non_max_suppression(all_predictions)
+    # Merge the fold predictions with class-aware NMS or weighted box fusion
+    final_boxes, final_scores, final_classes = fuse_predictions(all_predictions, fusion, len(models))
     
     return final_boxes, final_scores, final_classes
 
+def letterbox_crops(cropped_images, imgsz=640):
+    # Letterbox every crop to the same size so each fold sees the whole set in a few batched calls
+    batch = []
+    transforms = []
+    for index, cropped_image in enumerate(cropped_images):
+        if cropped_image.size == 0:
+            continue
+        canvas, scale, pad = letterbox(cropped_image, imgsz)
+        batch.append(canvas)
+        transforms.append((index, scale, pad, cropped_image.shape[:2]))
+    return batch, transforms
+
+def run_folds(folds, batch, transforms, all_predictions, imgsz=640, batch_size=32):
+    # folds: (fold index, model) pairs. Appends one (n, 6) array per fold to all_predictions[crop index],
+    # with the boxes back in crop coordinates
+    collector = metrics.active
+    for fold, model in folds:
+        for start in range(0, len(batch), batch_size):
+            results = model(batch[start:start + batch_size], imgsz=imgsz)
+            if collector is not None:
+                collector.inc('ppe_fold_calls_total', fold=fold)
+                collector.inc('ppe_fold_images_total', len(results), fold=fold)
+            for result, (index, scale, (pad_x, pad_y), (height, width)) in zip(results, transforms[start:start + batch_size]):
+                boxes = result.boxes.copy().reshape(-1, 4)
+                # Undo the letterbox so boxes are in crop coordinates again
+                boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad_x) / scale, 0, width)
+                boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad_y) / scale, 0, height)
+                all_predictions[index].append(np.column_stack((boxes, result.scores, result.classes)).reshape(-1, 6))
+
+def fuse_crop_predictions(predictions, fusion="nms", num_models=1):
+    if sum(len(p) for p in predictions) == 0:
+        return np.array([]), np.array([]), np.array([])
+    predictions = np.vstack(predictions)
+    if metrics.active is not None:
+        metrics.active.observe('ppe_nms_input_boxes', len(predictions))
+    return fuse_predictions(predictions, fusion, num_models)
+
+def detect_ppe_ensemble_batch(cropped_images, models, imgsz=640, batch_size=32, fusion="nms"):
+    batch, transforms = letterbox_crops(cropped_images, imgsz)
+    all_predictions = [[] for _ in cropped_images]
+    if isinstance(models, FoldCascade):
+        return detect_ppe_cascade(models, batch, transforms, all_predictions, imgsz, batch_size, fusion)
+
+    run_folds(list(enumerate(models)), batch, transforms, all_predictions, imgsz, batch_size)
+    return [fuse_crop_predictions(predictions, fusion, len(models)) for predictions in all_predictions]
+
+def detect_ppe_cascade(cascade, batch, transforms, all_predictions, imgsz=640, batch_size=32, fusion="nms"):
+    folds = list(zip(cascade.order, cascade))
+    first, rest = folds[:cascade.min_folds], folds[cascade.min_folds:]
+    run_folds(first, batch, transforms, all_predictions, imgsz, batch_size)
+    results = [fuse_crop_predictions(predictions, fusion, len(first)) for predictions in all_predictions]
+
+    # Crops the first folds disagree on fall through to the remaining folds, as does a sample of the others
+    # so the early exits can be checked against the full ensemble
+    stable = [cascade.agree(all_predictions[index]) for index, _, _, _ in transforms]
+    fall_through = [i for i, is_stable in enumerate(stable) if not is_stable or cascade.sample_audit()]
+    if rest and fall_through:
+        run_folds(rest, [batch[i] for i in fall_through], [transforms[i] for i in fall_through],
+                  all_predictions, imgsz, batch_size)
+        for i in fall_through:
+            index = transforms[i][0]
+            full_result = fuse_crop_predictions(all_predictions[index], fusion, len(folds))
+            if stable[i]:
+                cascade.record_audit(results[index], full_result)
+            else:
+                results[index] = full_result
+    cascade.record(len(transforms), sum(stable), len(transforms) * len(first) + (len(fall_through) * len(rest)))
+    return results
+
+def crop_persons(image, person_boxes):
+    crops = []
+    offsets = []
+    for box in person_boxes:
+        x1, y1, x2, y2 = map(int, box)
+        crops.append(image[y1:y2, x1:x2])
+        offsets.append((x1, y1))
+    if metrics.active is not None:
+        metrics.active.observe('ppe_crops_per_image', sum(crop.size > 0 for crop in crops))
+    return crops, offsets
+
+def offset_ppe_results(offsets, ensemble_results):
+    # Shift crop-relative PPE boxes back into image coordinates
+    ppe_results = []
+    for (x1, y1), (ppe_boxes, ppe_scores, ppe_classes) in zip(offsets, ensemble_results):
+        for ppe_box, ppe_score, ppe_class in zip(ppe_boxes, ppe_scores, ppe_classes):
+            ppe_x1, ppe_y1, ppe_x2, ppe_y2 = map(int, ppe_box)
+            ppe_results.append({
+                'box': [x1 + ppe_x1, y1 + ppe_y1, x1 + ppe_x2, y1 + ppe_y2],
+                'class': int(ppe_class),  # Convert to int
+                'score': ppe_score
+            })
+    return ppe_results
+
+def plan_crops(image, person_boxes, crop_planner):
+    # Crops of the planned regions: merged overlapping persons, without tiny or degenerate boxes
+    regions = crop_planner.plan(person_boxes, image.shape)
+    crops, _ = crop_persons(image, [region_box for region_box, _ in regions])
+    return crops, regions
+
+def detect_ppe_batch(image, person_boxes, ppe_models, imgsz=640, batch_size=32, fusion="nms", crop_planner=None):
+    # Run the PPE ensemble on every person in the image at once and return boxes in image coordinates
+    if crop_planner is None:
+        crops, offsets = crop_persons(image, person_boxes)
+        ensemble_results = detect_ppe_ensemble_batch(crops, ppe_models, imgsz, batch_size, fusion)
+    else:
+        crops, regions = plan_crops(image, person_boxes, crop_planner)
+        region_results = detect_ppe_ensemble_batch(crops, ppe_models, imgsz, batch_size, fusion)
+        offsets, ensemble_results = crop_planner.assign(person_boxes, regions, region_results)
+    return offset_ppe_results(offsets, ensemble_results)
+
+def detect_images(images, person_model, ppe_models, fusion="nms", ppe_batch_size=32, timings=None, crop_planner=None):
+    # Both stages for several images at once: one person call, then the crops of all images batched together.
+    # When a timings dict is passed, the wall time of each stage for the whole batch is stored in it.
+    start = time.perf_counter()
+    person_detections = detect_persons_batch(images, person_model)
+    person_seconds = time.perf_counter() - start
+
+    crops, offsets, plans = [], [], []
+    for image, (person_boxes, _) in zip(images, person_detections):
+        if crop_planner is None:
+            image_crops, image_offsets = crop_persons(image, person_boxes)
+            offsets.append(image_offsets)
+        else:
+            image_crops, regions = plan_crops(image, person_boxes, crop_planner)
+            plans.append(regions)
+        crops.append(image_crops)
+    ensemble_results = detect_ppe_ensemble_batch([crop for image_crops in crops for crop in image_crops], ppe_models,
+                                                 batch_size=ppe_batch_size, fusion=fusion)
+    if timings is not None:
+        timings['person'] = person_seconds
+        timings['ppe'] = time.perf_counter() - start - person_seconds
+
+    ppe_results = []
+    first = 0
+    for image_index, (person_boxes, _) in enumerate(person_detections):
+        image_results = ensemble_results[first:first + len(crops[image_index])]
+        first += len(crops[image_index])
+        if crop_planner is None:
+            ppe_results.append(offset_ppe_results(offsets[image_index], image_results))
+        else:
+            ppe_results.append(offset_ppe_results(*crop_planner.assign(person_boxes, plans[image_index], image_results)))
+    return [(person_boxes, person_scores, image_ppe_results)
+            for (person_boxes, person_scores), image_ppe_results in zip(person_detections, ppe_results)]
+
 def non_max_suppression(predictions, iou_threshold=0.5, score_threshold=0.5):
-    # Sort by score
-    indices = np.argsort(predictions[:, 4])[::-1]
-    predictions = predictions[indices]
-    
-    keep = []
-    while predictions.shape[0] > 0:
-        keep.append(predictions[0])
-        if predictions.shape[0] == 1:
-            break
-        ious = calculate_iou(predictions[0, :4], predictions[1:, :4])
-        predictions = predictions[1:][ious < iou_threshold]
-    
-    keep = np.array(keep)
-    
-    # Handle the case where keep is 1D (only one prediction kept)
-    if keep.ndim == 1:
-        keep = keep.reshape(1, -1)
-    
-    final_boxes = keep[:, :4]
-    final_scores = keep[:, 4]
-    final_classes = keep[:, 5]
-    
-    # Filter by score threshold
-    mask = final_scores >= score_threshold
-    final_boxes = final_boxes[mask]
-    final_scores = final_scores[mask]
-    final_classes = final_classes[mask]
-    
-    return final_boxes, final_scores, final_classes
+    # Class-aware, vectorized replacement for the original per-box loop
+    return nms(predictions, iou_threshold, score_threshold)
 
 def calculate_iou(box, boxes):
     # Calculate IoU between a box and an array of boxes
@@ -102,55 +342,223 @@ def draw_boxes(image, boxes, classes, scores, colors, class_mapping):
     return image
 
 
-def process_image(image_path, person_model, ppe_models, output_dir, class_mapping):
-    image = cv2.imread(image_path)
-    person_boxes, person_scores = detect_persons(image, person_model)
-    
-    ppe_results = []
-    for box in person_boxes:
-        x1, y1, x2, y2 = map(int, box)
-        cropped_image = image[y1:y2, x1:x2]
-        ppe_boxes, ppe_scores, ppe_classes = detect_ppe_ensemble(cropped_image, ppe_models)
-        
-        for ppe_box, ppe_score, ppe_class in zip(ppe_boxes, ppe_scores, ppe_classes):
-            ppe_x1, ppe_y1, ppe_x2, ppe_y2 = map(int, ppe_box)
-            ppe_results.append({
-                'box': [x1 + ppe_x1, y1 + ppe_y1, x1 + ppe_x2, y1 + ppe_y2],
-                'class': int(ppe_class),  # Convert to int
-                'score': ppe_score
-            })
-    
+# Define colors for different classes (using integer keys)
+PPE_COLORS = {
+    0: (255, 0, 0),    # hard-hat
+    1: (0, 255, 0),    # gloves
+    2: (0, 0, 255),    # mask
+    3: (255, 255, 0),  # glasses
+    4: (255, 0, 255),  # boots
+    5: (0, 255, 255),  # vest
+    6: (128, 0, 128)   # ppe-suit
+}
+
+def annotate_image(image, ppe_results, class_mapping):
     # Only use PPE detections
     all_boxes = np.array([r['box'] for r in ppe_results])
     all_classes = np.array([r['class'] for r in ppe_results])
     all_scores = np.array([r['score'] for r in ppe_results])
     
-    # Define colors for different classes (using integer keys)
-    colors = {
-        0: (255, 0, 0),    # hard-hat
-        1: (0, 255, 0),    # gloves
-        2: (0, 0, 255),    # mask
-        3: (255, 255, 0),  # glasses
-        4: (255, 0, 255),  # boots
-        5: (0, 255, 255),  # vest
-        6: (128, 0, 128)   # ppe-suit
-    }
+    # Draw boxes on a copy of the image
+    return draw_boxes(image.copy(), all_boxes, all_classes, all_scores, PPE_COLORS, class_mapping)
+
+def load_image(image_source):
+    # Accepts a file path or an encoded image already in memory (bytes, bytearray, memoryview)
+    if isinstance(image_source, (str, os.PathLike)):
+        return cv2.imread(image_source)
+    return cv2.imdecode(np.frombuffer(image_source, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def read_image_bytes(image_source):
+    if isinstance(image_source, (str, os.PathLike)):
+        with open(image_source, 'rb') as f:
+            return f.read()
+    return image_source
+
+# libjpeg decodes directly at 1/2, 1/4 and 1/8 scale, far cheaper than a full decode plus resize
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def image_dimensions(image_bytes):
+    # (width, height) from a JPEG or PNG header without decoding, None for anything else
+    data = memoryview(image_bytes)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+def load_image_reduced(image_bytes, max_side):
+    # Decodes at the smallest 1/2^k scale whose long side is still at least max_side.
+    # Returns the reduced image and the (height, width) of the full-resolution image.
+    dimensions = image_dimensions(image_bytes)
+    flag = cv2.IMREAD_COLOR
+    if dimensions is not None:
+        for factor, reduced_flag in REDUCED_READ_FLAGS:
+            if max(dimensions) / factor >= max_side:
+                flag = reduced_flag
+                break
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), flag)
+    if image is None:
+        return None, None
+    if dimensions is None:
+        return image, image.shape[:2]
+    width, height = dimensions
+    # The decoder applies the EXIF orientation, the header does not
+    if (image.shape[0] > image.shape[1]) != (height > width):
+        width, height = height, width
+    return image, (height, width)
+
+def detect_persons_reduced(image_bytes, model, person_imgsz, timings=None):
+    # Person detection on a reduced-resolution decode, boxes scaled back to full-resolution coordinates
+    start = time.perf_counter()
+    image, full_shape = load_image_reduced(image_bytes, person_imgsz)
+    if timings is not None:
+        timings['decode_reduced'] = time.perf_counter() - start
+    if image is None:
+        return None
+
+    start = time.perf_counter()
+    person_boxes, person_scores = detect_persons(image, model, imgsz=person_imgsz)
+    scale_x, scale_y = full_shape[1] / image.shape[1], full_shape[0] / image.shape[0]
+    person_boxes = np.asarray(person_boxes, dtype=np.float32).reshape(-1, 4) * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+    if timings is not None:
+        timings['person'] = time.perf_counter() - start
+    return person_boxes, person_scores, full_shape
+
+def process_image(image_source, person_model, ppe_models, output_dir, class_mapping, fusion="nms", name=None,
+                  results_writer=None, render=True, cache=None, person_imgsz=0, crop_planner=None, ppe_batch_size=32):
+    image_name = str(name or (image_source if isinstance(image_source, (str, os.PathLike)) else ''))
+    timings = {}
+    collector = metrics.active
+    if collector is None:
+        return _process_image(image_source, image_name, timings, person_model, ppe_models, output_dir, class_mapping,
+                              fusion, results_writer, render, cache, person_imgsz, crop_planner,
+                              ppe_batch_size)
+    with collector.image(image_name, timings):
+        return _process_image(image_source, image_name, timings, person_model, ppe_models, output_dir, class_mapping,
+                              fusion, results_writer, render, cache, person_imgsz, crop_planner,
+                              ppe_batch_size)
+
+def _process_image(image_source, image_name, timings, person_model, ppe_models, output_dir, class_mapping, fusion,
+                   results_writer, render, cache, person_imgsz, crop_planner, ppe_batch_size):
+    # A cache hit skips inference, and decoding too when nothing has to be drawn
+    cached = None
+    if cache is not None:
+        start = time.perf_counter()
+        try:
+            image_source = read_image_bytes(image_source)
+        except OSError:
+            # Skipped like an unreadable image without a cache
+            return None
+        cache_key = cache.key(image_source)
+        cached = cache.get(cache_key)
+        timings['cache'] = time.perf_counter() - start
+    
+    # With person_imgsz the person stage sees a reduced decode and the full-resolution decode is deferred
+    reduced = bool(person_imgsz) and cached is None
+    image = None
+    image_shape = None
+    if (cached is None or render) and not reduced:
+        start = time.perf_counter()
+        image = load_image(image_source)
+        timings['decode'] = time.perf_counter() - start
+        if image is None:
+            return None
+        image_shape = image.shape
+    
+    if cached is None:
+        if reduced:
+            try:
+                image_source = read_image_bytes(image_source)
+            except OSError:
+                return None
+            detection = detect_persons_reduced(image_source, person_model, person_imgsz, timings)
+            if detection is None:
+                return None
+            person_boxes, person_scores, image_shape = detection
+            # Full resolution is only needed for the person crops and for drawing
+            if len(person_boxes) > 0 or render:
+                start = time.perf_counter()
+                image = load_image(image_source)
+                timings['decode'] = time.perf_counter() - start
+                if image is None:
+                    return None
+        else:
+            start = time.perf_counter()
+            person_boxes, person_scores = detect_persons(image, person_model)
+            timings['person'] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        ppe_results = (detect_ppe_batch(image, person_boxes, ppe_models, batch_size=ppe_batch_size, fusion=fusion,
+                                        crop_planner=crop_planner)
+                       if len(person_boxes) > 0 else [])
+        timings['ppe'] = time.perf_counter() - start
+        
+        if cache is not None:
+            cache.put(cache_key, make_record(image_name, image_shape, person_boxes, person_scores, ppe_results, timings))
+    else:
+        person_boxes, person_scores = cached['person_boxes'], cached['person_scores']
+        ppe_results = record_ppe_results(cached)
+        if image_shape is None:
+            image_shape = (cached['height'], cached['width'])
     
-    # Draw boxes on the image
-    annotated_image = draw_boxes(image.copy(), all_boxes, all_classes, all_scores, colors, class_mapping)
+    annotated_image = None
+    if render:
+        start = time.perf_counter()
+        annotated_image = annotate_image(image, ppe_results, class_mapping)
+        timings['render'] = time.perf_counter() - start
+        
+        # Save the annotated image, in-memory callers pass output_dir=None and use the returned array
+        if output_dir is not None:
+            start = time.perf_counter()
+            output_path = os.path.join(output_dir, os.path.basename(image_name))
+            cv2.imwrite(output_path, annotated_image)
+            timings['encode'] = time.perf_counter() - start
     
-    # Save the annotated image
-    output_path = os.path.join(output_dir, os.path.basename(image_path))
-    cv2.imwrite(output_path, annotated_image)
+    record = None
+    if results_writer is not None or not render:
+        record = make_record(image_name, image_shape, person_boxes, person_scores, ppe_results, timings)
+    if results_writer is not None:
+        results_writer.write(record)
+    # Without rendering the record is returned instead, so None always means the image could not be read
+    return annotated_image if render else record
+
+def make_cascade(args, ppe_models):
+    if not args.cascade:
+        return ppe_models
+    order = [int(i) for i in args.cascade_order.split(',')] if args.cascade_order else None
+    return FoldCascade(ppe_models, order, args.cascade_min_folds, args.cascade_iou, args.cascade_score_tolerance,
+                       audit_rate=args.cascade_audit)
+
+def make_crop_planner(args):
+    if not args.merge_crops:
+        return None
+    return CropPlanner(args.min_crop_size, args.max_region_size, args.merge_overlap)
+
+def open_result_cache(args, crop_planner=None, cascade=None):
+    if not args.cache_dir:
+        return None
+    from result_cache import ResultCache, models_fingerprint
+    fingerprint = models_fingerprint(args.person_model, args.ppe_models_dir, args.backend, args.fusion,
+                                     person_imgsz=args.person_imgsz, crop_plan=repr(crop_planner) if crop_planner else "",
+                                     cascade=repr(cascade) if cascade else "", ppe_soup=args.ppe_soup)
+    return ResultCache(args.cache_dir, fingerprint, args.cache_max_mb * 1024 * 1024)
 
 def main():
     args = parse_arguments()
     
-    person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir)
-    
-    if not ppe_models:
-        raise ValueError("No PPE models found in the specified directory")
-    
     os.makedirs(args.output_dir, exist_ok=True)
     
     class_mapping = {
@@ -163,10 +571,83 @@ def main():
         6: 'ppe-suit'
     }
     
-    for image_file in os.listdir(args.input_dir):
-        if image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image_path = os.path.join(args.input_dir, image_file)
-            process_image(image_path, person_model, ppe_models, args.output_dir, class_mapping)
+    if args.autotune:
+        from autotune import autotune
+        autotune(args, class_mapping, tune_config_path(args))
+        return
+    
+    if args.workers > 1 and not args.video:
+        # Every worker process loads its own copy of the models
+        from sharded_inference import run_sharded
+        run_sharded(args, class_mapping)
+        return
+    
+    configure_threads(args.torch_threads, args.cv2_threads)
+    person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend, args.ppe_soup)
+    
+    if not ppe_models:
+        raise ValueError("No PPE models found in the specified directory")
+    
+    ppe_models = make_cascade(args, ppe_models)
+    collector = metrics.enable_from_args(args)
+    
+    if args.video:
+        from video import process_video
+        process_video(args.video, person_model, ppe_models, args.output_dir, class_mapping, fusion=args.fusion,
+                      detect_every=args.detect_every, ppe_refresh_frames=args.ppe_refresh, ppe_change_iou=args.ppe_change_iou)
+        if args.cascade:
+            print(cascade_summary(ppe_models.stats(), len(ppe_models)))
+        if collector is not None and args.metrics:
+            collector.write(args.metrics)
+        return
+    
+    results_writer = ResultWriter(args.results, args.results_format, append=args.watch) if args.results else None
+    crop_planner = make_crop_planner(args)
+    cache = open_result_cache(args, crop_planner, ppe_models if args.cascade else None)
+    
+    if args.watch:
+        from model_registry import warm_up
+        from watch import watch_folder
+        # The models stay loaded for the life of the process; warm them up before the first image arrives
+        warm_up(person_model, ppe_models)
+        watch_folder(args.input_dir, person_model, ppe_models, args.output_dir, class_mapping,
+                     args.manifest or os.path.join(args.output_dir, "watch_manifest.sqlite"), args.fusion,
+                     args.settle_seconds, args.poll_interval, results_writer=results_writer, render=args.render,
+                     cache=cache, person_imgsz=args.person_imgsz, crop_planner=crop_planner,
+                     ppe_batch_size=args.ppe_batch_size)
+    elif args.pipeline:
+        from pipeline import iter_image_paths, run_pipeline
+        packed = open_packed_input(args.input_dir)
+        images = packed.iter_images() if packed is not None else iter_image_paths(args.input_dir)
+        run_pipeline(images, person_model, ppe_models, args.output_dir, class_mapping,
+                     fusion=args.fusion, batch_size=args.batch_size, decode_workers=args.decode_workers,
+                     write_workers=args.write_workers, queue_size=args.queue_size,
+                     results_writer=results_writer, render=args.render, cache=cache, crop_planner=crop_planner,
+                     ppe_batch_size=args.ppe_batch_size)
+    else:
+        packed = open_packed_input(args.input_dir)
+        if packed is not None:
+            images = packed.iter_images()
+        else:
+            image_paths = (os.path.join(args.input_dir, image_file) for image_file in os.listdir(args.input_dir)
+                           if image_file.lower().endswith(IMAGE_EXTENSIONS))
+            images = ((image_path, image_path) for image_path in image_paths)
+        for name, image_source in images:
+            process_image(image_source, person_model, ppe_models, args.output_dir, class_mapping, args.fusion, name=name,
+                          results_writer=results_writer, render=args.render, cache=cache, person_imgsz=args.person_imgsz,
+                          crop_planner=crop_planner, ppe_batch_size=args.ppe_batch_size)
+    
+    if results_writer is not None:
+        results_writer.close()
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+    if crop_planner is not None:
+        print(crop_planner.summary())
+    if args.cascade:
+        print(cascade_summary(ppe_models.stats(), len(ppe_models)))
+    if collector is not None and args.metrics:
+        collector.write(args.metrics)
 
 
 if __name__ == "__main__":
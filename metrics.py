@@ -0,0 +1,203 @@
+# Opt-in hot-path instrumentation for inference.py
+# Per-stage latency histograms, persons and crops per image, PPE fold calls and NMS input sizes, exported
+# in the Prometheus text format (file or HTTP endpoint), plus a sampling cProfile hook that keeps the
+# profiles of the slowest images. Disabled by default: the instrumented functions only check `active`.
+
+import bisect
+import cProfile
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The enabled Metrics instance, None when instrumentation is off
+active = None
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# name: (type, help, buckets)
+METRICS = {
+    'ppe_stage_seconds': ('histogram', "Latency of each process_image stage", LATENCY_BUCKETS),
+    'ppe_image_seconds': ('histogram', "End-to-end latency of one image (with --pipeline the sum of its stage times)", LATENCY_BUCKETS),
+    'ppe_persons_per_image': ('histogram', "Persons detected per image", COUNT_BUCKETS),
+    'ppe_crops_per_image': ('histogram', "Non-empty person crops sent to the PPE ensemble per image", COUNT_BUCKETS),
+    'ppe_nms_input_boxes': ('histogram', "Fold predictions entering NMS/fusion per crop", COUNT_BUCKETS),
+    'ppe_fold_calls_total': ('counter', "Calls into each PPE fold model", None),
+    'ppe_fold_images_total': ('counter', "Crops passed to each PPE fold model", None),
+    'ppe_images_total': ('counter', "Images processed", None),
+}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> [bucket counts..., sum, count] for histograms, value for counters
+        self._histograms = {}
+        self._counters = {}
+        self.profiler = None
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_stages(self, timings):
+        for stage, seconds in timings.items():
+            self.observe('ppe_stage_seconds', seconds, stage=stage)
+
+    @contextmanager
+    def image(self, name, timings):
+        # Wraps one process_image call: stage histograms from its timings dict, total latency and sampled profiling
+        profile = self.profiler.start() if self.profiler is not None else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                self.profiler.finish(profile, name, elapsed)
+            self.record_stages(timings)
+            self.observe('ppe_image_seconds', elapsed)
+            self.inc('ppe_images_total')
+
+    def snapshot(self):
+        # Plain dicts, picklable so worker processes can hand their metrics to the parent
+        with self._lock:
+            return {'histograms': {k: list(v) for k, v in self._histograms.items()}, 'counters': dict(self._counters)}
+
+    def merge(self, snapshot):
+        with self._lock:
+            for key, series in snapshot['histograms'].items():
+                current = self._histograms.setdefault(key, [0] * (len(series) - 2) + [0.0, 0])
+                for i, value in enumerate(series):
+                    current[i] += value
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = snapshot['histograms'] if kind == 'histogram' else snapshot['counters']
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append(f"{name}{_format_labels(labels)} {series[key]}")
+                    continue
+                counts = series[key]
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {counts[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {counts[-1]}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        # Atomic replace so a node_exporter textfile collector never reads a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="0.0.0.0"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+class SlowestProfiles:
+    # Profiles a random sample of images and keeps the .prof files of the slowest `keep` of them
+    def __init__(self, output_dir, keep=10, sample_rate=0.1):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self._heap = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Only one cProfile can be active at a time, concurrent callers are simply not sampled
+        self._active = threading.Lock()
+
+    def start(self):
+        if random.random() >= self.sample_rate or not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, name, elapsed):
+        profile.disable()
+        self._active.release()
+        with self._lock:
+            if len(self._heap) >= self.keep and elapsed <= self._heap[0][0]:
+                return
+            stem = os.path.splitext(os.path.basename(name))[0] or "image"
+            path = os.path.join(self.output_dir, f"{elapsed * 1000:09.1f}ms_{stem}_{next(self._ids)}.prof")
+            profile.dump_stats(path)
+            heapq.heappush(self._heap, (elapsed, path))
+            if len(self._heap) > self.keep:
+                _, dropped = heapq.heappop(self._heap)
+                os.remove(dropped)
+
+def enable(profile_dir=None, profile_slowest=0, profile_sample=0.1):
+    global active
+    active = Metrics()
+    if profile_dir and profile_slowest > 0:
+        active.profiler = SlowestProfiles(profile_dir, profile_slowest, profile_sample)
+    return active
+
+def enable_from_args(args, serve=True):
+    # Turns instrumentation on when any of the --metrics options was given, returns the instance or None
+    if not (args.metrics or args.metrics_port or args.profile_slowest):
+        return None
+    profile_dir = args.profile_dir or os.path.join(args.output_dir, "profiles")
+    collector = enable(profile_dir, args.profile_slowest, args.profile_sample)
+    if serve and args.metrics_port:
+        collector.serve(args.metrics_port)
+    return collector
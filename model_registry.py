@@ -0,0 +1,59 @@
+# Process-wide cache of loaded models, shared by every Streamlit session
+# Models are loaded and warmed up once, and reloaded only when the weight files actually change.
+
+import hashlib
+import os
+import threading
+import numpy as np
+from inference import detect_persons_batch, detect_ppe_ensemble_batch, list_ppe_model_paths, load_models
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _stat_signature(path):
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+def weight_paths(person_model_path, ppe_models_dir):
+    return [os.path.abspath(person_model_path)] + sorted(os.path.abspath(p) for p in list_ppe_model_paths(ppe_models_dir))
+
+def warm_up(person_model, ppe_models, size=640):
+    # One forward pass through every model so the first real request does not pay for lazy initialisation
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    detect_persons_batch([image], person_model)
+    detect_ppe_ensemble_batch([image], ppe_models)
+
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, person_model_path, ppe_models_dir, backend="torch"):
+        key = (os.path.abspath(person_model_path), os.path.abspath(ppe_models_dir), backend)
+        paths = weight_paths(person_model_path, ppe_models_dir)
+        stats = [_stat_signature(path) for path in paths]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['stats'] == stats:
+                return entry['models']
+
+            # mtimes or sizes moved: only reload if the contents really differ (e.g. not just touched)
+            digests = [file_digest(path) for path in paths]
+            if entry is not None and entry['digests'] == digests:
+                entry['stats'] = stats
+                return entry['models']
+
+            models = load_models(person_model_path, ppe_models_dir, backend)
+            warm_up(*models)
+            self._entries[key] = {'stats': stats, 'digests': digests, 'models': models}
+            return models
+
+_registry = ModelRegistry()
+
+def get_models(person_model_path, ppe_models_dir, backend="torch"):
+    return _registry.get(person_model_path, ppe_models_dir, backend)
@@ -0,0 +1,195 @@
+# Collapse the ppe_fold_* ensemble into one weight-averaged checkpoint ("model soup")
+# Usage: python model_soup.py --ppe_models_dir <ppe_models_dir> [--calib_dir <images>] [--eval_dir <dataset>]
+#
+# The folds share an architecture and a starting point, so their weights can be averaged into a single model.
+# Averaging shifts the batch-norm statistics, which --calib_dir re-estimates on a few hundred images.
+# --eval_dir (a YOLO dataset with images/ and labels/) compares the soup with the full ensemble.
+# inference.py --ppe_soup <soup.pt> then runs the one model instead of every fold.
+
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+from engines import letterbox, load_engine
+from fusion import box_iou
+from inference import IMAGE_EXTENSIONS, detect_ppe_ensemble_batch, list_ppe_model_paths
+
+class_mapping = {
+    0: 'hard-hat',
+    1: 'gloves',
+    2: 'mask',
+    3: 'glasses',
+    4: 'boots',
+    5: 'vest',
+    6: 'ppe-suit'
+}
+
+def load_checkpoint(path):
+    import torch
+    # ultralytics checkpoints pickle the whole model, not just tensors
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+def checkpoint_model(checkpoint):
+    model = checkpoint.get('ema')
+    return (model if model is not None else checkpoint['model']).float()
+
+def average_state_dicts(state_dicts):
+    import torch
+    reference = state_dicts[0]
+    for state_dict in state_dicts[1:]:
+        if state_dict.keys() != reference.keys() or any(state_dict[k].shape != reference[k].shape for k in reference):
+            raise ValueError("The fold checkpoints do not share an architecture and cannot be averaged")
+
+    averaged = {}
+    for key, tensor in reference.items():
+        if tensor.is_floating_point():
+            averaged[key] = torch.stack([state_dict[key].float() for state_dict in state_dicts]).mean(dim=0).to(tensor.dtype)
+        else:
+            # Integer buffers such as num_batches_tracked
+            averaged[key] = tensor.clone()
+    return averaged
+
+def make_soup(fold_paths):
+    checkpoints = [load_checkpoint(path) for path in fold_paths]
+    models = [checkpoint_model(checkpoint) for checkpoint in checkpoints]
+    soup = models[0]
+    soup.load_state_dict(average_state_dicts([model.state_dict() for model in models]))
+    return checkpoints[0], soup
+
+def load_images(images_dir, limit=0):
+    image_files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        image_files = image_files[:limit]
+    return image_files, [cv2.imread(os.path.join(images_dir, f)) for f in image_files]
+
+def to_tensor(images, imgsz=640):
+    import torch
+    batch = np.stack([letterbox(image, imgsz)[0][:, :, ::-1].transpose(2, 0, 1) for image in images])
+    return torch.from_numpy(np.ascontiguousarray(batch)).float() / 255.0
+
+def recalibrate_batchnorm(model, images, imgsz=640, batch_size=16):
+    # Re-estimate the running mean/variance of every BN layer with a cumulative average over the images
+    import torch
+    batchnorms = [m for m in model.modules() if isinstance(m, torch.nn.modules.batchnorm._BatchNorm)]
+    for batchnorm in batchnorms:
+        batchnorm.reset_running_stats()
+        batchnorm.momentum = None
+    model.train()
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            model(to_tensor(images[start:start + batch_size], imgsz))
+    model.eval()
+    return len(batchnorms)
+
+def save_soup(checkpoint, soup, fold_paths, output_path):
+    import torch
+    checkpoint = dict(checkpoint)
+    checkpoint.update({
+        'model': soup.half(),
+        'ema': None,
+        'optimizer': None,
+        'updates': None,
+        'soup_of': [os.path.basename(path) for path in fold_paths],
+    })
+    torch.save(checkpoint, output_path)
+
+def load_labels(label_path, width, height):
+    # YOLO format: class x_center y_center width height, normalised
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4)), np.zeros(0, dtype=int)
+    rows = np.loadtxt(label_path, ndmin=2)
+    if rows.size == 0:
+        return np.zeros((0, 4)), np.zeros(0, dtype=int)
+    xc, yc, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return np.column_stack((xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2)), rows[:, 0].astype(int)
+
+def match_counts(boxes, scores, classes, gt_boxes, gt_classes, iou_threshold=0.5):
+    # Greedy per-class matching by descending score; returns {class: [tp, fp, fn]}
+    counts = {}
+    classes = np.asarray(classes, dtype=int)
+    for cls in set(classes.tolist()) | set(gt_classes.tolist()):
+        predicted = np.asarray(boxes).reshape(-1, 4)[classes == cls]
+        order = np.argsort(-np.asarray(scores)[classes == cls])
+        truth = gt_boxes[gt_classes == cls]
+        matched = np.zeros(len(truth), dtype=bool)
+        tp = 0
+        if len(predicted) and len(truth):
+            ious = box_iou(predicted[order].astype(np.float64), truth.astype(np.float64))
+            for row in ious:
+                candidates = np.flatnonzero((row >= iou_threshold) & ~matched)
+                if len(candidates):
+                    matched[candidates[row[candidates].argmax()]] = True
+                    tp += 1
+        counts[cls] = [tp, len(predicted) - tp, len(truth) - tp]
+    return counts
+
+def evaluate(models, images, labels, fusion="nms", batch_size=32):
+    totals = {}
+    start = time.perf_counter()
+    for first in range(0, len(images), batch_size):
+        batch = images[first:first + batch_size]
+        for (boxes, scores, classes), (gt_boxes, gt_classes) in zip(
+                detect_ppe_ensemble_batch(batch, models, batch_size=batch_size, fusion=fusion), labels[first:first + batch_size]):
+            for cls, counts in match_counts(boxes, scores, classes, gt_boxes, gt_classes).items():
+                totals.setdefault(cls, [0, 0, 0])
+                totals[cls] = [a + b for a, b in zip(totals[cls], counts)]
+    seconds_per_image = (time.perf_counter() - start) / max(1, len(images))
+    return totals, seconds_per_image
+
+def f1_scores(counts):
+    tp, fp, fn = counts
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+def print_comparison(ensemble, soup, num_folds):
+    (ensemble_counts, ensemble_seconds), (soup_counts, soup_seconds) = ensemble, soup
+    print(f"{'class':<10} {'ensemble P/R/F1':>22} {'soup P/R/F1':>22}")
+    for cls in sorted(set(ensemble_counts) | set(soup_counts)):
+        e = f1_scores(ensemble_counts.get(cls, [0, 0, 0]))
+        s = f1_scores(soup_counts.get(cls, [0, 0, 0]))
+        print(f"{class_mapping.get(cls, cls):<10} {e[0]:>8.3f}{e[1]:>7.3f}{e[2]:>7.3f} {s[0]:>8.3f}{s[1]:>7.3f}{s[2]:>7.3f}")
+    e = f1_scores([sum(c[i] for c in ensemble_counts.values()) for i in range(3)])
+    s = f1_scores([sum(c[i] for c in soup_counts.values()) for i in range(3)])
+    print(f"{'all':<10} {e[0]:>8.3f}{e[1]:>7.3f}{e[2]:>7.3f} {s[0]:>8.3f}{s[1]:>7.3f}{s[2]:>7.3f}")
+    print(f"PPE stage: {ensemble_seconds * 1000:.1f} ms per crop with {num_folds} folds, "
+          f"{soup_seconds * 1000:.1f} ms with the soup ({ensemble_seconds / max(soup_seconds, 1e-9):.1f}x faster)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Average the PPE fold checkpoints into one model.")
+    parser.add_argument('--ppe_models_dir', required=True, help="Directory containing the ppe_fold_* checkpoints.")
+    parser.add_argument('--output', help="Soup checkpoint to write (default: <ppe_models_dir>/ppe_soup.pt).")
+    parser.add_argument('--calib_dir', help="Images (person crops) to recalibrate the batch-norm statistics on.")
+    parser.add_argument('--calib_images', type=int, default=256, help="Most calibration images to use.")
+    parser.add_argument('--eval_dir', help="Labelled YOLO dataset (images/ and labels/) to compare soup and ensemble on.")
+    parser.add_argument('--eval_images', type=int, default=0, help="Most evaluation images to use (default: all).")
+    parser.add_argument('--imgsz', type=int, default=640, help="Input size for calibration.")
+    parser.add_argument('--fusion', choices=['nms', 'wbf'], default='nms', help="Fusion of the ensemble predictions.")
+    args = parser.parse_args()
+
+    fold_paths = list_ppe_model_paths(args.ppe_models_dir)
+    if len(fold_paths) < 2:
+        raise ValueError("Need at least two ppe_fold_* checkpoints to make a soup")
+    output_path = args.output or os.path.join(args.ppe_models_dir, "ppe_soup.pt")
+
+    checkpoint, soup = make_soup(fold_paths)
+    print(f"Averaged {len(fold_paths)} folds")
+    if args.calib_dir:
+        _, calib_images = load_images(args.calib_dir, args.calib_images)
+        layers = recalibrate_batchnorm(soup, [image for image in calib_images if image is not None], args.imgsz)
+        print(f"Recalibrated {layers} batch-norm layers on {len(calib_images)} images")
+    save_soup(checkpoint, soup, fold_paths, output_path)
+    print(f"Saved {output_path}")
+
+    if args.eval_dir:
+        image_files, images = load_images(os.path.join(args.eval_dir, 'images'), args.eval_images)
+        labels = [load_labels(os.path.join(args.eval_dir, 'labels', os.path.splitext(f)[0] + '.txt'), *image.shape[1::-1])
+                  for f, image in zip(image_files, images)]
+        ensemble_models = [load_engine(path) for path in fold_paths]
+        print_comparison(evaluate(ensemble_models, images, labels, args.fusion),
+                         evaluate([load_engine(output_path)], images, labels, args.fusion), len(fold_paths))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# Streaming producer/consumer pipeline for directory runs of inference.py
+# Decoding, model inference and drawing/encoding run in separate stages connected by bounded
+# queues, so disk I/O overlaps with the models and memory stays flat however large the directory is.
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import metrics
+from inference import IMAGE_EXTENSIONS, annotate_image, detect_images, load_image, read_image_bytes
+from results_io import make_record, record_ppe_results
+
+_DONE = object()
+
+def iter_image_paths(input_dir):
+    # Lazily yield image paths so huge directories are never listed into memory at once
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+def _feed_paths(image_paths, path_queue, decode_workers, errors):
+    try:
+        for image_path in image_paths:
+            path_queue.put(image_path)
+    except Exception as e:
+        # Listing the input failed; kept for run_pipeline to re-raise once the stages have drained
+        errors.append(e)
+    finally:
+        for _ in range(decode_workers):
+            path_queue.put(_DONE)
+
+def _decode_item(image_path, cache, render):
+    # Packed datasets feed (name, encoded bytes) instead of a path
+    image_path, image_source = image_path if isinstance(image_path, tuple) else (image_path, image_path)
+    item = {'path': image_path, 'image': None, 'timings': {}, 'cache_key': None, 'cached': None, 'detection': None}
+
+    if cache is not None:
+        start = time.perf_counter()
+        image_source = read_image_bytes(image_source)
+        item['cache_key'] = cache.key(image_source)
+        item['cached'] = cache.get(item['cache_key'])
+        item['timings']['cache'] = time.perf_counter() - start
+        # Nothing to draw and nothing to infer: skip decoding altogether
+        if item['cached'] is not None and not render:
+            return item
+
+    start = time.perf_counter()
+    item['image'] = load_image(image_source)
+    item['timings']['decode'] = time.perf_counter() - start
+    if item['image'] is None:
+        print(f"Could not read {image_path}. Skipping.")
+        return None
+    return item
+
+def _decode_worker(path_queue, decoded_queue, cache, render):
+    try:
+        while True:
+            image_path = path_queue.get()
+            if image_path is _DONE:
+                return
+            try:
+                item = _decode_item(image_path, cache, render)
+            except Exception as e:
+                # A vanished file or a cache error skips the image instead of stalling the pipeline
+                name = image_path[0] if isinstance(image_path, tuple) else image_path
+                print(f"Could not read {name}: {e}. Skipping.")
+                continue
+            if item is not None:
+                decoded_queue.put(item)
+    finally:
+        # The model stage counts these to know when every decoder is finished
+        decoded_queue.put(_DONE)
+
+def _next_batch(decoded_queue, batch_size, decoders_left):
+    # Block for the first image, then take whatever else is already decoded up to batch_size
+    batch = []
+    while decoders_left and len(batch) < batch_size:
+        try:
+            item = decoded_queue.get(block=not batch)
+        except queue.Empty:
+            break
+        if item is _DONE:
+            decoders_left -= 1
+        else:
+            batch.append(item)
+    return batch, decoders_left
+
+def _finish_image(item, output_dir, class_mapping, render, results_writer):
+    person_boxes, person_scores, ppe_results = item['detection']
+    image, timings = item['image'], item['timings']
+    if render:
+        start = time.perf_counter()
+        annotated_image = annotate_image(image, ppe_results, class_mapping)
+        timings['render'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cv2.imwrite(os.path.join(output_dir, os.path.basename(item['path'])), annotated_image)
+        timings['encode'] = time.perf_counter() - start
+    if results_writer is not None:
+        image_shape = image.shape if image is not None else (item['cached']['height'], item['cached']['width'])
+        results_writer.write(make_record(item['path'], image_shape, person_boxes, person_scores, ppe_results, timings))
+    if metrics.active is not None:
+        metrics.active.record_stages(timings)
+        # Stages of different images overlap here, so an image's latency is the sum of its own stage times
+        # (model time being its share of the batch) rather than wall time
+        metrics.active.observe('ppe_image_seconds', sum(timings.values()))
+        metrics.active.inc('ppe_images_total')
+
+def run_pipeline(image_paths, person_model, ppe_models, output_dir, class_mapping, fusion="nms",
+                 batch_size=8, decode_workers=4, write_workers=2, queue_size=32, results_writer=None, render=True,
+                 cache=None, crop_planner=None, ppe_batch_size=32):
+    path_queue = queue.Queue(maxsize=queue_size)
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    # Caps the annotated images waiting on the writers, the model stage blocks when it is exhausted
+    write_slots = threading.BoundedSemaphore(queue_size)
+
+    feed_errors = []
+    feeder = threading.Thread(target=_feed_paths, args=(image_paths, path_queue, decode_workers, feed_errors), daemon=True)
+    feeder.start()
+    decoders = [threading.Thread(target=_decode_worker, args=(path_queue, decoded_queue, cache, render), daemon=True)
+                for _ in range(decode_workers)]
+    for decoder in decoders:
+        decoder.start()
+
+    processed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=write_workers) as writers:
+        pending_writes = []
+        decoders_left = decode_workers
+        while decoders_left:
+            batch, decoders_left = _next_batch(decoded_queue, batch_size, decoders_left)
+            if not batch:
+                continue
+
+            # Cache hits reuse their stored detections, only the misses go through the models
+            misses = [item for item in batch if item['cached'] is None]
+            if misses:
+                batch_timings = {}
+                miss_detections = detect_images([item['image'] for item in misses], person_model, ppe_models,
+                                                fusion=fusion, ppe_batch_size=ppe_batch_size, timings=batch_timings,
+                                                crop_planner=crop_planner)
+                for item, detection in zip(misses, miss_detections):
+                    # Model time is shared by the whole batch, so each image is charged its average share
+                    item['timings'].update({stage: seconds / len(misses) for stage, seconds in batch_timings.items()})
+                    item['detection'] = detection
+                    if cache is not None:
+                        person_boxes, person_scores, ppe_results = detection
+                        cache.put(item['cache_key'], make_record(item['path'], item['image'].shape, person_boxes,
+                                                                 person_scores, ppe_results, item['timings']))
+
+            for item in batch:
+                cached = item['cached']
+                if cached is not None:
+                    item['detection'] = (cached['person_boxes'], cached['person_scores'], record_ppe_results(cached))
+                if not render:
+                    _finish_image(item, output_dir, class_mapping, render, results_writer)
+                    continue
+                write_slots.acquire()
+                future = writers.submit(_finish_image, item, output_dir, class_mapping, render, results_writer)
+                future.add_done_callback(lambda _: write_slots.release())
+                pending_writes.append(future)
+            processed += len(batch)
+
+            # Surface writer errors early and keep the list of futures short
+            still_pending = []
+            for future in pending_writes:
+                if future.done():
+                    future.result()
+                else:
+                    still_pending.append(future)
+            pending_writes = still_pending
+
+        for future in pending_writes:
+            future.result()
+
+    feeder.join()
+    if feed_errors:
+        raise feed_errors[0]
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} images in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.2f} images/sec)")
+    return processed, elapsed
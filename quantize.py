@@ -0,0 +1,123 @@
+# INT8 versions of the person model and the PPE folds for CPU inference (inference.py --backend int8)
+# Usage: python quantize.py --person_model <person_model_path> --ppe_models_dir <ppe_models_dir> --calib_dir <images>
+#
+# Each checkpoint is exported to ONNX (cached by engines.export_onnx) and quantized with ONNX Runtime static
+# quantization: INT8 weights per channel, activations calibrated on images from --calib_dir. The person model is
+# calibrated on the full images, the PPE folds on the person crops the fp32 person model finds in them.
+# Artifacts are written next to the originals as <name>.int8.onnx and rebuilt only when the fp32 model is newer.
+# The report compares latency, model size and detection agreement with fp32.
+
+import argparse
+import os
+import re
+import time
+import cv2
+from engines import OnnxEngine, compare_engines, export_onnx, int8_path
+from inference import IMAGE_EXTENSIONS, crop_persons, list_ppe_model_paths
+
+class CalibrationReader:
+    # Feeds preprocessed images to the ONNX Runtime calibrator one batch at a time
+    def __init__(self, input_name, images, imgsz=640, batch_size=8):
+        self.input_name = input_name
+        self.images = images
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self._start = 0
+
+    def get_next(self):
+        if self._start >= len(self.images):
+            return None
+        batch, _ = OnnxEngine.preprocess(self.images[self._start:self._start + self.batch_size], self.imgsz)
+        self._start += self.batch_size
+        return {self.input_name: batch}
+
+    def rewind(self):
+        self._start = 0
+
+def head_nodes(onnx_path):
+    # The Detect head (the highest-numbered /model.N/ block of an ultralytics export) decodes boxes and is
+    # sensitive to quantization error, so it stays in fp32
+    import onnx
+    names = [node.name for node in onnx.load(onnx_path).graph.node]
+    blocks = [int(m.group(1)) for m in (re.match(r"/model\.(\d+)/", name) for name in names) if m]
+    if not blocks:
+        return []
+    head = f"/model.{max(blocks)}/"
+    return [name for name in names if name.startswith(head)]
+
+def quantize_model(weights_path, calib_images, imgsz=640, force=False):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    onnx_path = export_onnx(weights_path, imgsz)
+    quantized_path = int8_path(weights_path)
+    if not force and os.path.exists(quantized_path) and os.path.getmtime(quantized_path) >= os.path.getmtime(onnx_path):
+        return quantized_path
+
+    input_name = OnnxEngine(onnx_path).input_name
+    # Write to a temporary name so an interrupted run never leaves a half-written artifact behind
+    tmp_path = quantized_path + ".tmp"
+    quantize_static(
+        onnx_path, tmp_path, CalibrationReader(input_name, calib_images, imgsz),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax, nodes_to_exclude=head_nodes(onnx_path),
+    )
+    os.replace(tmp_path, quantized_path)
+    return quantized_path
+
+def load_calibration_images(calib_dir, limit=100):
+    image_files = sorted(f for f in os.listdir(calib_dir) if f.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    images = [cv2.imread(os.path.join(calib_dir, f)) for f in image_files]
+    return [image for image in images if image is not None]
+
+def person_crops(images, person_engine, imgsz=640):
+    crops = []
+    for image in images:
+        detections = person_engine([image], imgsz)[0]
+        image_crops, _ = crop_persons(image, detections.boxes)
+        crops.extend(crop for crop in image_crops if crop.size > 0)
+    return crops
+
+def latency(engine, images, imgsz=640):
+    engine(images[:1], imgsz)
+    start = time.perf_counter()
+    for image in images:
+        engine([image], imgsz)
+    return (time.perf_counter() - start) / max(1, len(images))
+
+def report_row(name, fp32_path, quantized_path, images, imgsz):
+    fp32, int8 = OnnxEngine(fp32_path), OnnxEngine(quantized_path)
+    fp32_seconds, int8_seconds = latency(fp32, images, imgsz), latency(int8, images, imgsz)
+    agreement = compare_engines(fp32, int8, images, imgsz)
+    fp32_mb, int8_mb = os.path.getsize(fp32_path) / 1e6, os.path.getsize(quantized_path) / 1e6
+    print(f"{name:<20} {fp32_mb:>9.1f} {int8_mb:>9.1f} {fp32_seconds * 1000:>10.1f} {int8_seconds * 1000:>10.1f} "
+          f"{fp32_seconds / max(int8_seconds, 1e-9):>8.2f}x {agreement * 100:>9.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the person and PPE models to INT8 with ONNX Runtime.")
+    parser.add_argument('--person_model', required=True, help="Path to the person detection model.")
+    parser.add_argument('--ppe_models_dir', required=True, help="Directory containing PPE detection models.")
+    parser.add_argument('--calib_dir', required=True, help="Directory of images to calibrate (and compare) on.")
+    parser.add_argument('--calib_images', type=int, default=100, help="Most calibration images to use.")
+    parser.add_argument('--imgsz', type=int, default=640, help="Inference size.")
+    parser.add_argument('--force', action='store_true', help="Re-quantize even when the INT8 artifacts are up to date.")
+    args = parser.parse_args()
+
+    images = load_calibration_images(args.calib_dir, args.calib_images)
+    if not images:
+        raise ValueError(f"No readable images in {args.calib_dir}")
+
+    person_int8 = quantize_model(args.person_model, images, args.imgsz, args.force)
+    # The folds only ever see person crops, so that is what they are calibrated on
+    crops = person_crops(images, OnnxEngine(export_onnx(args.person_model, args.imgsz)), args.imgsz) or images
+    fold_paths = list_ppe_model_paths(args.ppe_models_dir)
+    fold_int8 = [quantize_model(path, crops, args.imgsz, args.force) for path in fold_paths]
+
+    print(f"{'model':<20} {'fp32 (MB)':>9} {'int8 (MB)':>9} {'fp32 (ms)':>10} {'int8 (ms)':>10} {'speedup':>9} {'agreement':>10}")
+    report_row(os.path.basename(args.person_model), export_onnx(args.person_model, args.imgsz), person_int8, images, args.imgsz)
+    for path, quantized_path in zip(fold_paths, fold_int8):
+        report_row(os.path.basename(path), export_onnx(path, args.imgsz), quantized_path, crops, args.imgsz)
+    print("Run inference.py with --backend int8 to use the quantized models")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Render annotated images later from results stored by inference.py --results (e.g. after a --no-render run)
+# Usage: python render_results.py --results <results.jsonl|results.parquet> --output_dir <output_dir> [--input_dir <input_dir>]
+
+import argparse
+import os
+import cv2
+from inference import annotate_image
+from results_io import RESULT_FORMATS, read_results, record_ppe_results
+
+class_mapping = {
+    0: 'hard-hat',
+    1: 'gloves',
+    2: 'mask',
+    3: 'glasses',
+    4: 'boots',
+    5: 'vest',
+    6: 'ppe-suit'
+}
+
+def render_results(results_path, output_dir, input_dir=None, result_format=None):
+    os.makedirs(output_dir, exist_ok=True)
+    rendered = 0
+    for record in read_results(results_path, result_format):
+        # Records store the path the image was read from; --input_dir points at a moved copy
+        image_path = os.path.join(input_dir, os.path.basename(record['image'])) if input_dir else record['image']
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"Could not read {image_path}. Skipping.")
+            continue
+        annotated_image = annotate_image(image, record_ppe_results(record), class_mapping)
+        cv2.imwrite(os.path.join(output_dir, os.path.basename(image_path)), annotated_image)
+        rendered += 1
+    print(f"Rendered {rendered} images to {output_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw stored PPE detections onto their images.")
+    parser.add_argument('--results', required=True, help="Results file written by inference.py --results.")
+    parser.add_argument('--output_dir', required=True, help="Directory to save the annotated images.")
+    parser.add_argument('--input_dir', help="Directory holding the images, if they moved since the run.")
+    parser.add_argument('--results_format', choices=RESULT_FORMATS, help="Results file format (default: from the file extension).")
+    args = parser.parse_args()
+
+    render_results(args.results, args.output_dir, args.input_dir, args.results_format)
+
+if __name__ == "__main__":
+    main()
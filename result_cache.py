@@ -0,0 +1,102 @@
+# Persistent content-addressed cache of detection results
+# The key is the SHA-256 of the encoded image bytes plus a fingerprint of everything that can change the
+# detections (person model, the set of ppe_fold_* weights, backend and fusion settings), so re-runs over
+# overlapping image sets skip decoding and inference for images already seen. Size-bounded, evicted LRU.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from inference import list_ppe_model_paths
+from model_registry import file_digest
+
+def models_fingerprint(person_model_path, ppe_models_dir, backend="torch", fusion="nms",
+                       iou_threshold=0.5, score_threshold=0.5, person_imgsz=0, crop_plan="", cascade="", ppe_soup=None):
+    digest = hashlib.sha256()
+    digest.update(file_digest(person_model_path).encode())
+    if ppe_soup:
+        digest.update(f"soup:{file_digest(ppe_soup)}".encode())
+    else:
+        # The fold set is order independent, the same weights under another name hash the same
+        for fold_digest in sorted(file_digest(path) for path in list_ppe_model_paths(ppe_models_dir)):
+            digest.update(fold_digest.encode())
+    digest.update(f"{backend}|{fusion}|{iou_threshold}|{score_threshold}".encode())
+    # Reduced-resolution person detection gives different boxes; default runs keep their existing keys
+    if person_imgsz:
+        digest.update(f"|person_imgsz={person_imgsz}".encode())
+    if crop_plan:
+        digest.update(f"|crop_plan={crop_plan}".encode())
+    if cascade:
+        digest.update(f"|cascade={cascade}".encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, cache_dir, fingerprint, max_bytes=1 << 30):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Shared by the pipeline threads and, through SQLite locking, by --workers processes
+        self._db = sqlite3.connect(os.path.join(cache_dir, "results.sqlite"), timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+        self._size = self._total_size()
+
+    def _total_size(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def key(self, image_bytes):
+        return hashlib.sha256(bytes(image_bytes)).hexdigest() + ":" + self.fingerprint
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, record):
+        value = json.dumps(record).encode()
+        with self._lock:
+            # A replaced entry no longer counts towards the size
+            row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._size += len(value) - (row[0] if row is not None else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Drop the least recently used entries beyond max_bytes
+        self._db.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running FROM entries) "
+            "WHERE running > ?)",
+            (self.max_bytes,),
+        )
+        self._size = self._total_size()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"Result cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
@@ -0,0 +1,130 @@
+# Structured detection output: one record per image written as JSONL or Parquet in batches
+# Records hold the person boxes, the PPE boxes/classes/scores and per-stage timings in seconds.
+
+import json
+import os
+import threading
+import numpy as np
+
+RESULT_FORMATS = ("jsonl", "parquet")
+
+def make_record(image, image_shape, person_boxes, person_scores, ppe_results, timings):
+    height, width = image_shape[:2]
+    return {
+        'image': image,
+        'width': int(width),
+        'height': int(height),
+        'person_boxes': np.asarray(person_boxes, dtype=float).reshape(-1, 4).tolist(),
+        'person_scores': np.asarray(person_scores, dtype=float).tolist(),
+        'ppe_boxes': [[float(v) for v in r['box']] for r in ppe_results],
+        'ppe_classes': [int(r['class']) for r in ppe_results],
+        'ppe_scores': [float(r['score']) for r in ppe_results],
+        'timings': {stage: float(seconds) for stage, seconds in timings.items()},
+    }
+
+def record_ppe_results(record):
+    # Inverse of make_record for the PPE part, in the layout annotate_image expects
+    return [
+        {'box': box, 'class': cls, 'score': score}
+        for box, cls, score in zip(record['ppe_boxes'], record['ppe_classes'], record['ppe_scores'])
+    ]
+
+def infer_result_format(path, result_format=None):
+    if result_format:
+        return result_format
+    return "parquet" if path.endswith(".parquet") else "jsonl"
+
+def _parquet_schema():
+    import pyarrow as pa
+    box = pa.list_(pa.float32(), 4)
+    return pa.schema([
+        ('image', pa.string()),
+        ('width', pa.int32()),
+        ('height', pa.int32()),
+        ('person_boxes', pa.list_(box)),
+        ('person_scores', pa.list_(pa.float32())),
+        ('ppe_boxes', pa.list_(box)),
+        ('ppe_classes', pa.list_(pa.int32())),
+        ('ppe_scores', pa.list_(pa.float32())),
+        ('timings', pa.map_(pa.string(), pa.float64())),
+    ])
+
+class ResultWriter:
+    # Thread-safe; records are buffered and written batch_size at a time. append continues an existing JSONL file.
+    def __init__(self, path, result_format=None, batch_size=256, append=False):
+        self.path = path
+        self.format = infer_result_format(path, result_format)
+        if self.format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown results format: {self.format}")
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = None
+        self._parquet_writer = None
+
+        if self.format == "jsonl":
+            self._file = open(path, 'a' if append else 'w')
+        elif append:
+            raise ValueError("Parquet results cannot be appended to, use a .jsonl results file")
+        else:
+            import pyarrow.parquet as pq
+            self._parquet_writer = pq.ParquetWriter(path, _parquet_schema())
+
+    def write(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self.format == "jsonl":
+            self._file.write(''.join(json.dumps(record) + '\n' for record in self._buffer))
+            self._file.flush()
+        else:
+            import pyarrow as pa
+            records = [dict(record, timings=list(record['timings'].items())) for record in self._buffer]
+            self._parquet_writer.write_table(pa.Table.from_pylist(records, schema=_parquet_schema()))
+        self._buffer = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_results(path, result_format=None):
+    if infer_result_format(path, result_format) == "jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            for record in batch.to_pylist():
+                record['timings'] = dict(record['timings'])
+                yield record
+
+def merge_results(part_paths, path, result_format=None):
+    # Concatenate per-worker result files into one and remove the parts
+    with ResultWriter(path, result_format) as writer:
+        for part_path in part_paths:
+            if not os.path.exists(part_path):
+                continue
+            for record in read_results(part_path, result_format):
+                writer.write(record)
+            os.remove(part_path)
@@ -0,0 +1,211 @@
+# HTTP inference service with dynamic micro-batching
+# Usage: python service.py --person_model <person_model_path> --ppe_models_dir <ppe_models_dir> [--port 8000]
+#        python service.py --stub                      (stub models from benchmarks/, no weights needed)
+#
+# POST /detect with the encoded image as the request body (or a multipart field named "image") returns the
+# detections as JSON, in the record layout of results_io; add ?annotated=1 for a base64 JPEG with the boxes drawn.
+# Concurrent requests are coalesced into micro-batches for the person stage and for the PPE crop stage.
+# Both stages have bounded queues and requests that do not fit are shed with 503.
+
+import argparse
+import asyncio
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from aiohttp import web
+from engines import BACKENDS
+from inference import (annotate_image, crop_persons, detect_persons_batch, detect_ppe_ensemble_batch, load_image,
+                       offset_ppe_results)
+from results_io import make_record
+
+class Overloaded(Exception):
+    pass
+
+class MicroBatcher:
+    # Collects submitted items until max_batch_size is reached or the oldest waited max_wait seconds,
+    # then runs the blocking batch_fn on its own thread so the event loop keeps accepting requests
+    def __init__(self, name, batch_fn, max_batch_size=8, max_wait=0.005, max_queue=64):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.batches = 0
+        self.items = 0
+        self.shed = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def submit_many(self, items):
+        # All or nothing, so a shed request leaves no orphaned work in the queue
+        if self.queue.maxsize - self.queue.qsize() < len(items):
+            self.shed += 1
+            raise Overloaded(f"{self.name} queue is full")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self.queue.put_nowait((item, future))
+            futures.append(future)
+        return asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests cancelled while waiting (client went away) are not worth a model call
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'shed': self.shed,
+        }
+
+class DetectionService:
+    def __init__(self, person_model, ppe_models, class_mapping, fusion="nms", max_batch_size=8, ppe_max_batch_size=32,
+                 max_wait=0.005, max_queue=64, ppe_max_queue=256):
+        self.class_mapping = class_mapping
+        self.persons = MicroBatcher("person", lambda images: detect_persons_batch(images, person_model),
+                                    max_batch_size, max_wait, max_queue)
+        self.ppe = MicroBatcher("ppe", lambda crops: detect_ppe_ensemble_batch(crops, ppe_models, batch_size=ppe_max_batch_size,
+                                                                            fusion=fusion),
+                                ppe_max_batch_size, max_wait, ppe_max_queue)
+        # Decoding and encoding run off the event loop too
+        self.codec = ThreadPoolExecutor(max_workers=2, thread_name_prefix="codec")
+
+    async def start(self, app):
+        self.persons.start()
+        self.ppe.start()
+
+    async def stop(self, app):
+        await self.persons.stop()
+        await self.ppe.stop()
+        self.codec.shutdown(wait=False)
+
+    async def detect(self, request):
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            if 'image' not in form:
+                raise web.HTTPBadRequest(text="multipart body needs an 'image' field")
+            image_bytes, name = form['image'].file.read(), form['image'].filename
+        else:
+            image_bytes, name = await request.read(), request.query.get('name', '')
+        if not image_bytes:
+            raise web.HTTPBadRequest(text="empty request body")
+
+        loop = asyncio.get_running_loop()
+        timings = {}
+        try:
+            start = time.perf_counter()
+            image = await loop.run_in_executor(self.codec, load_image, image_bytes)
+            timings['decode'] = time.perf_counter() - start
+            if image is None:
+                raise web.HTTPBadRequest(text="could not decode the image")
+
+            start = time.perf_counter()
+            (person_boxes, person_scores), = await self.persons.submit_many([image])
+            timings['person'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            crops, offsets = crop_persons(image, person_boxes)
+            ensemble_results = await self.ppe.submit_many(crops) if crops else []
+            ppe_results = offset_ppe_results(offsets, ensemble_results)
+            timings['ppe'] = time.perf_counter() - start
+        except Overloaded as e:
+            raise web.HTTPServiceUnavailable(text=str(e), headers={'Retry-After': '1'})
+
+        response = make_record(name, image.shape, person_boxes, person_scores, ppe_results, timings)
+        if request.query.get('annotated', '0') not in ('0', 'false', ''):
+            annotated_image = annotate_image(image, ppe_results, self.class_mapping)
+            _, encoded = await loop.run_in_executor(self.codec, cv2.imencode, '.jpg', annotated_image)
+            response['annotated_image'] = base64.b64encode(encoded.tobytes()).decode()
+        return web.json_response(response)
+
+    async def health(self, request):
+        return web.json_response({'status': 'ok', 'person': self.persons.stats(), 'ppe': self.ppe.stats()})
+
+def make_app(service, max_request_mb=32):
+    app = web.Application(client_max_size=max_request_mb * 1024 * 1024)
+    app.router.add_post('/detect', service.detect)
+    app.router.add_get('/health', service.health)
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service for person and PPE detection.")
+    parser.add_argument('--person_model', help="Path to the person detection model.")
+    parser.add_argument('--ppe_models_dir', help="Directory containing PPE detection models.")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Inference engine.")
+    parser.add_argument('--fusion', choices=['nms', 'wbf'], default='nms', help="How to merge the PPE fold predictions.")
+    parser.add_argument('--stub', action='store_true', help="Serve the stub models from benchmarks/ instead of real weights.")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on.")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on.")
+    parser.add_argument('--max_batch_size', type=int, default=8, help="Most images per person-stage batch.")
+    parser.add_argument('--ppe_max_batch_size', type=int, default=32, help="Most person crops per PPE-stage batch.")
+    parser.add_argument('--max_wait_ms', type=float, default=5.0, help="Longest a request waits for its batch to fill.")
+    parser.add_argument('--max_queue', type=int, default=64, help="Images queued for the person stage before shedding with 503.")
+    parser.add_argument('--ppe_max_queue', type=int, default=256, help="Crops queued for the PPE stage before shedding with 503.")
+    args = parser.parse_args()
+
+    if args.stub:
+        from benchmarks.stubs import load_stub_models
+        person_model, ppe_models = load_stub_models()
+    elif args.person_model and args.ppe_models_dir:
+        from model_registry import get_models
+        person_model, ppe_models = get_models(args.person_model, args.ppe_models_dir, args.backend)
+    else:
+        parser.error("--person_model and --ppe_models_dir are required unless --stub is given")
+
+    class_mapping = {
+        0: 'hard-hat',
+        1: 'gloves',
+        2: 'mask',
+        3: 'glasses',
+        4: 'boots',
+        5: 'vest',
+        6: 'ppe-suit'
+    }
+
+    service = DetectionService(person_model, ppe_models, class_mapping, args.fusion, args.max_batch_size,
+                               args.ppe_max_batch_size, args.max_wait_ms / 1000, args.max_queue, args.ppe_max_queue)
+    web.run_app(make_app(service), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
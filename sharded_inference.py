@@ -0,0 +1,141 @@
+# Multi-process sharded inference for large image dumps
+# The input directory is split round-robin across worker processes; each worker loads the models
+# once and gets an equal share of the CPU threads so torch and OpenCV do not oversubscribe the cores.
+# A packed dataset is split into contiguous blocks of image indices instead, so every worker maps the pack
+# and reads its own stretch of the shards sequentially.
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+from cascade import cascade_summary
+from inference import (IMAGE_EXTENSIONS, configure_threads, load_models, make_cascade, make_crop_planner, open_packed_input,
+                       open_result_cache, process_image)
+from results_io import ResultWriter, merge_results
+
+def _part_path(results_path, worker_index):
+    root, ext = os.path.splitext(results_path)
+    return f"{root}.part{worker_index}{ext}"
+
+def _run_shard(worker_index, image_paths, args, class_mapping, num_threads):
+    configure_threads(num_threads, num_threads)
+    # Workers do not serve metrics themselves, the parent merges their snapshots
+    collector = metrics.enable_from_args(args, serve=False)
+
+    start = time.perf_counter()
+    person_model, ppe_models = load_models(args.person_model, args.ppe_models_dir, args.backend, args.ppe_soup)
+    load_seconds = time.perf_counter() - start
+    if not ppe_models:
+        raise ValueError("No PPE models found in the specified directory")
+    ppe_models = make_cascade(args, ppe_models)
+
+    # Each worker writes its own part of the results, merged by the parent at the end
+    results_writer = ResultWriter(_part_path(args.results, worker_index), args.results_format) if args.results else None
+    crop_planner = make_crop_planner(args)
+    cache = open_result_cache(args, crop_planner, ppe_models if args.cascade else None)
+
+    # (name, source) pairs; a packed worker's image_paths are indices into the pack
+    packed = open_packed_input(args.input_dir)
+    images = packed.iter_images(image_paths) if packed is not None else ((path, path) for path in image_paths)
+
+    start = time.perf_counter()
+    if args.pipeline:
+        from pipeline import run_pipeline
+        processed, _ = run_pipeline(images, person_model, ppe_models, args.output_dir, class_mapping,
+                                    fusion=args.fusion, batch_size=args.batch_size, decode_workers=args.decode_workers,
+                                    write_workers=args.write_workers, queue_size=args.queue_size,
+                                    results_writer=results_writer, render=args.render, cache=cache, crop_planner=crop_planner,
+                                    ppe_batch_size=args.ppe_batch_size)
+    else:
+        processed = 0
+        for name, image_source in images:
+            # None is an image that could not be read
+            if process_image(image_source, person_model, ppe_models, args.output_dir, class_mapping, args.fusion, name=name,
+                             results_writer=results_writer, render=args.render, cache=cache, person_imgsz=args.person_imgsz,
+                             crop_planner=crop_planner, ppe_batch_size=args.ppe_batch_size) is not None:
+                processed += 1
+    elapsed = time.perf_counter() - start
+
+    if results_writer is not None:
+        results_writer.close()
+    cache_hits = cache_misses = 0
+    if cache is not None:
+        cache_hits, cache_misses = cache.hits, cache.misses
+        cache.close()
+
+    return {
+        'worker': worker_index,
+        'pid': os.getpid(),
+        'threads': num_threads,
+        'images': processed,
+        'load_seconds': load_seconds,
+        'seconds': elapsed,
+        'images_per_sec': processed / elapsed if elapsed > 0 else 0.0,
+        'cache_hits': cache_hits,
+        'cache_misses': cache_misses,
+        'cascade': ppe_models.stats() if args.cascade else None,
+        'num_folds': len(ppe_models),
+        'crop_plan': (crop_planner.persons, crop_planner.dropped, crop_planner.regions) if crop_planner else None,
+        'metrics': collector.snapshot() if collector is not None else None,
+    }
+
+def shard_paths(image_paths, num_shards):
+    # Round-robin keeps shards balanced even when file sizes cluster by name
+    return [image_paths[i::num_shards] for i in range(num_shards)]
+
+def shard_blocks(image_indices, num_shards):
+    # Contiguous blocks of a packed dataset, as even in size as round-robin
+    return [image_indices[len(image_indices) * i // num_shards:len(image_indices) * (i + 1) // num_shards]
+            for i in range(num_shards)]
+
+def run_sharded(args, class_mapping):
+    packed = open_packed_input(args.input_dir)
+    if packed is not None:
+        image_paths = list(range(len(packed)))
+    else:
+        image_paths = sorted(
+            os.path.join(args.input_dir, f) for f in os.listdir(args.input_dir)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    num_workers = max(1, min(args.workers, len(image_paths)))
+    shards = shard_blocks(image_paths, num_workers) if packed is not None else shard_paths(image_paths, num_workers)
+    num_threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+
+    # Spawn instead of fork so no torch/OpenMP thread state is inherited from the parent
+    context = multiprocessing.get_context("spawn")
+    collector = metrics.enable_from_args(args)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(_run_shard, index, shard, args, class_mapping, num_threads)
+            for index, shard in enumerate(shards)
+        ]
+        stats = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    if args.results:
+        merge_results([_part_path(args.results, i) for i in range(num_workers)], args.results, args.results_format)
+
+    print(f"{'worker':>6} {'pid':>8} {'threads':>7} {'images':>7} {'load (s)':>9} {'run (s)':>8} {'images/sec':>11}")
+    for s in stats:
+        print(f"{s['worker']:>6} {s['pid']:>8} {s['threads']:>7} {s['images']:>7} "
+              f"{s['load_seconds']:>9.1f} {s['seconds']:>8.1f} {s['images_per_sec']:>11.2f}")
+    total_images = sum(s['images'] for s in stats)
+    print(f"Processed {total_images} images with {num_workers} workers in {elapsed:.1f}s "
+          f"({total_images / elapsed if elapsed > 0 else 0.0:.2f} images/sec overall)")
+    if args.cache_dir:
+        print(f"Result cache: {sum(s['cache_hits'] for s in stats)} hits, {sum(s['cache_misses'] for s in stats)} misses")
+    if args.merge_crops:
+        persons, dropped, regions = (sum(s['crop_plan'][i] for s in stats) for i in range(3))
+        print(f"Crop planner: {persons} persons, {dropped} tiny or degenerate crops dropped, "
+              f"{regions} regions sent to the PPE ensemble")
+    if args.cascade:
+        totals = {key: sum(s['cascade'][key] for s in stats) for key in stats[0]['cascade']}
+        print(cascade_summary(totals, stats[0]['num_folds']))
+    if collector is not None:
+        for s in stats:
+            collector.merge(s['metrics'])
+        if args.metrics:
+            collector.write(args.metrics)
+    return stats
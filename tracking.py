@@ -0,0 +1,114 @@
+# Lightweight person tracker for video: constant-velocity Kalman filter per track and greedy IoU matching
+# Tracks also carry the last PPE result so the ensemble only re-runs when a person is new, moved or stale.
+
+import itertools
+import numpy as np
+from fusion import box_iou, paired_iou
+
+def _to_cxcywh(box):
+    x1, y1, x2, y2 = box[:4]
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float64)
+
+def _to_xyxy(cxcywh):
+    cx, cy, w, h = cxcywh
+    return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], dtype=np.float64)
+
+class Track:
+    # State is centre x, centre y, width, height and their velocities
+    _ids = itertools.count(1)
+
+    def __init__(self, box):
+        self.id = next(Track._ids)
+        self.x = np.zeros(8)
+        self.x[:4] = _to_cxcywh(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1000.0, 1000.0, 1000.0, 1000.0])
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+        self.Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.01, 0.01])
+        self.R = np.diag([1.0, 1.0, 10.0, 10.0])
+        self.hits = 1
+        self.missed = 0
+
+        # Last PPE ensemble result for this person, relative to ppe_box
+        self.ppe = None
+        self.ppe_box = None
+        self.ppe_frame = None
+
+    @property
+    def box(self):
+        return _to_xyxy(self.x[:4])
+
+    def predict(self):
+        # Keep the size positive when the box is shrinking fast
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0.0
+        if self.x[3] + self.x[7] <= 0:
+            self.x[7] = 0.0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def update(self, box):
+        residual = _to_cxcywh(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ residual
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+        self.hits += 1
+        self.missed = 0
+
+class PersonTracker:
+    def __init__(self, iou_threshold=0.3, max_missed=10):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+
+    def _match(self, boxes):
+        # Greedy assignment on descending IoU, enough for the handful of people in a frame
+        if not self.tracks or len(boxes) == 0:
+            return [], list(range(len(self.tracks))), list(range(len(boxes)))
+
+        predicted = np.array([track.box for track in self.tracks])
+        ious = box_iou(predicted, np.asarray(boxes, dtype=np.float64))
+        track_rows, box_cols = np.nonzero(ious >= self.iou_threshold)
+        order = np.argsort(-ious[track_rows, box_cols])
+
+        matches, used_tracks, used_boxes = [], set(), set()
+        for t, b in zip(track_rows[order], box_cols[order]):
+            if t not in used_tracks and b not in used_boxes:
+                matches.append((t, b))
+                used_tracks.add(t)
+                used_boxes.add(b)
+        unmatched_tracks = [t for t in range(len(self.tracks)) if t not in used_tracks]
+        unmatched_boxes = [b for b in range(len(boxes)) if b not in used_boxes]
+        return matches, unmatched_tracks, unmatched_boxes
+
+    def update(self, boxes):
+        # Frame with fresh person detections: returns the tracks seen in this frame
+        for track in self.tracks:
+            track.predict()
+
+        matches, unmatched_tracks, unmatched_boxes = self._match(boxes)
+        for t, b in matches:
+            self.tracks[t].update(boxes[b])
+        for t in unmatched_tracks:
+            self.tracks[t].missed += 1
+        for b in unmatched_boxes:
+            self.tracks.append(Track(boxes[b]))
+
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        return [track for track in self.tracks if track.missed == 0]
+
+    def predict(self):
+        # Frame without person detection: coast the tracks seen at the last detection
+        for track in self.tracks:
+            track.predict()
+        return [track for track in self.tracks if track.missed == 0]
+
+def needs_ppe(track, frame_index, change_iou=0.7, refresh_frames=30):
+    # New person, box changed substantially since the last PPE pass, or the result is stale
+    if track.ppe is None:
+        return True
+    if frame_index - track.ppe_frame >= refresh_frames:
+        return True
+    return paired_iou(track.box[None], track.ppe_box[None])[0] < change_iou
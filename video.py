@@ -0,0 +1,85 @@
+# Video / RTSP stream mode for inference.py
+# Persons are detected every N frames and tracked in between; the PPE ensemble only runs for
+# tracks that are new, moved substantially, or whose last PPE result is older than a refresh interval.
+
+import os
+import time
+import cv2
+import numpy as np
+from inference import annotate_image, crop_persons, detect_persons, detect_ppe_ensemble_batch, offset_ppe_results
+from tracking import PersonTracker, needs_ppe
+
+def open_capture(source):
+    # Camera indices arrive as strings from the command line
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+def _output_path(source, output_dir):
+    if source.isdigit() or "://" in source:
+        name = "stream"
+    else:
+        name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(output_dir, f"{name}_ppe.mp4")
+
+def _clip_boxes(boxes, width, height):
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes
+
+def process_video(source, person_model, ppe_models, output_dir, class_mapping, fusion="nms",
+                  detect_every=1, ppe_refresh_frames=30, ppe_change_iou=0.7, max_frames=0):
+    capture = open_capture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source {source}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+
+    tracker = PersonTracker()
+    writer = None
+    frame_index = 0
+    person_calls = 0
+    ppe_crops = 0
+    track_frames = 0
+    start = time.perf_counter()
+
+    while not max_frames or frame_index < max_frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        height, width = frame.shape[:2]
+
+        if frame_index % detect_every == 0:
+            person_boxes, _ = detect_persons(frame, person_model)
+            tracks = tracker.update(_clip_boxes(person_boxes, width, height))
+            person_calls += 1
+        else:
+            tracks = tracker.predict()
+        track_frames += len(tracks)
+
+        track_boxes = _clip_boxes([track.box for track in tracks], width, height)
+        refresh = [i for i, track in enumerate(tracks) if needs_ppe(track, frame_index, ppe_change_iou, ppe_refresh_frames)]
+        if refresh:
+            crops, _ = crop_persons(frame, track_boxes[refresh])
+            for i, ensemble_result in zip(refresh, detect_ppe_ensemble_batch(crops, ppe_models, fusion=fusion)):
+                tracks[i].ppe = ensemble_result
+                tracks[i].ppe_box = tracks[i].box
+                tracks[i].ppe_frame = frame_index
+            ppe_crops += len(refresh)
+
+        # Cached PPE boxes follow their person by anchoring them to the current track position
+        offsets = [(int(x1), int(y1)) for x1, y1, _, _ in track_boxes]
+        ppe_results = offset_ppe_results(offsets, [track.ppe for track in tracks])
+        annotated_frame = annotate_image(frame, ppe_results, class_mapping)
+
+        if writer is None:
+            writer = cv2.VideoWriter(_output_path(source, output_dir), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        writer.write(annotated_frame)
+        frame_index += 1
+
+    capture.release()
+    if writer is not None:
+        writer.release()
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {frame_index} frames in {elapsed:.1f}s ({frame_index / max(elapsed, 1e-9):.2f} fps)")
+    print(f"Person detection ran on {person_calls} frames, PPE ensemble on {ppe_crops} of {track_frames} person crops")
+    return {'frames': frame_index, 'person_calls': person_calls, 'ppe_crops': ppe_crops, 'track_frames': track_frames, 'seconds': elapsed}
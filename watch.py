@@ -0,0 +1,172 @@
+# Watch-folder mode for inference.py (--watch)
+# Images dropped into --input_dir are processed as they land, with the models loaded once and kept resident.
+# New files are found with inotify (inotify_simple, Linux) or by polling the directory. A file is only picked up
+# once its size and mtime stayed the same for --settle_seconds, so half-written uploads are not read.
+# Processed files are recorded in a SQLite manifest, so a restart resumes with whatever arrived in the meantime.
+
+import os
+import signal
+import sqlite3
+import threading
+import time
+from inference import IMAGE_EXTENSIONS, process_image
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class Manifest:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, status TEXT NOT NULL, processed_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        # In-memory copy so the directory scans never query the database per file
+        self.signatures = {path: (size, mtime_ns) for path, size, mtime_ns in
+                           self._db.execute("SELECT path, size, mtime_ns FROM processed")}
+
+    def is_processed(self, path, signature):
+        return self.signatures.get(path) == signature
+
+    def mark(self, path, signature, status="done"):
+        self._db.execute(
+            "INSERT OR REPLACE INTO processed (path, size, mtime_ns, status, processed_at) VALUES (?, ?, ?, ?, ?)",
+            (path, signature[0], signature[1], status, time.time()),
+        )
+        self._db.commit()
+        self.signatures[path] = signature
+
+    def close(self):
+        self._db.close()
+
+class FolderWatcher:
+    def __init__(self, input_dir, manifest, settle_seconds=2.0, poll_interval=1.0, rescan_interval=60.0):
+        self.input_dir = input_dir
+        self.manifest = manifest
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        # path -> (signature, time it was first seen with that signature)
+        self.pending = {}
+        self._next_rescan = 0.0
+        self._scanned = False
+        self._inotify = None
+        try:
+            from inotify_simple import INotify, flags
+            self._inotify = INotify()
+            self._inotify.add_watch(input_dir, flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO)
+            self._overflow = flags.Q_OVERFLOW
+        except (ImportError, OSError):
+            self._inotify = None
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify is not None else "polling"
+
+    def _scan(self):
+        with os.scandir(self.input_dir) as entries:
+            return {entry.path for entry in entries
+                    if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)}
+
+    def _changed_paths(self):
+        if self._inotify is None:
+            if self._scanned:
+                time.sleep(self.poll_interval)
+            self._scanned = True
+            return self._scan()
+
+        # With inotify a full scan still runs at startup, after a queue overflow and every rescan_interval
+        if time.monotonic() >= self._next_rescan:
+            self._next_rescan = time.monotonic() + self.rescan_interval
+            return self._scan()
+
+        timeout = self.settle_seconds if self.pending else self.poll_interval
+        paths = set()
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & self._overflow:
+                self._next_rescan = 0.0
+            elif event.name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.add(os.path.join(self.input_dir, event.name))
+        return paths
+
+    def ready(self):
+        # Paths whose size and mtime have settled and that the manifest has not seen in this state
+        now = time.monotonic()
+        ready = []
+        for path in self._changed_paths() | set(self.pending):
+            signature = file_signature(path)
+            if signature is None or signature[0] == 0 or self.manifest.is_processed(path, signature):
+                self.pending.pop(path, None)
+                continue
+            seen = self.pending.get(path)
+            # Files last modified longer than settle_seconds ago (e.g. found at startup) need no second look
+            if seen is None and time.time() - signature[1] / 1e9 >= self.settle_seconds:
+                ready.append((path, signature))
+            elif seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - seen[1] >= self.settle_seconds:
+                del self.pending[path]
+                ready.append((path, signature))
+        return sorted(ready)
+
+def watch_folder(input_dir, person_model, ppe_models, output_dir, class_mapping, manifest_path, fusion="nms",
+                 settle_seconds=2.0, poll_interval=1.0, results_writer=None, render=True, cache=None,
+                 person_imgsz=0, crop_planner=None, ppe_batch_size=32, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+
+    manifest = Manifest(manifest_path)
+    watcher = FolderWatcher(input_dir, manifest, settle_seconds, poll_interval)
+    print(f"Watching {input_dir} ({watcher.mode}), {len(manifest.signatures)} files already processed")
+
+    processed = 0
+    # Finished files whose records may still sit in the results buffer; marked only once the buffer is flushed,
+    # so a crash never leaves a file in the manifest without its results
+    unmarked = []
+
+    def mark_finished():
+        if results_writer is not None:
+            results_writer.flush()
+        for path, signature, status in unmarked:
+            manifest.mark(path, signature, status)
+        unmarked.clear()
+
+    try:
+        while not stop_event.is_set():
+            for path, signature in watcher.ready():
+                if stop_event.is_set():
+                    break
+                status = "done"
+                try:
+                    result = process_image(path, person_model, ppe_models, output_dir, class_mapping, fusion,
+                                           results_writer=results_writer, render=render, cache=cache,
+                                           person_imgsz=person_imgsz, crop_planner=crop_planner,
+                                           ppe_batch_size=ppe_batch_size)
+                    # None means the image could not be decoded
+                    if result is None:
+                        print(f"Could not read {path}")
+                        status = "failed"
+                    else:
+                        processed += 1
+                except Exception as e:
+                    # Retried only if the file changes again
+                    print(f"Failed on {path}: {e}")
+                    status = "failed"
+                unmarked.append((path, signature, status))
+                if results_writer is None or len(unmarked) >= results_writer.batch_size:
+                    mark_finished()
+            # Make results visible to readers while idle instead of holding them in the buffer
+            mark_finished()
+    finally:
+        mark_finished()
+        manifest.close()
+    print(f"Stopped watching, processed {processed} images")
+    return processed